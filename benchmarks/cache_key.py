@@ -0,0 +1,57 @@
+"""
+Compare the cost of deriving a Last.fm cache key on the cache hit path,
+from preparing the full request (the old approach)
+to the canonical key used by get_cached.
+
+Usage: python -m benchmarks.cache_key
+"""
+from timeit import repeat
+
+
+from requests import Request, Session
+
+
+from bot.util.cache import cache_handler, cache_key, cached_object
+
+BASE_URL = "https://ws.audioscrobbler.com/2.0/"
+PARAMS = {
+    "method": "user.getrecenttracks",
+    "user": "LMByrne",
+    "limit": 2,
+}
+
+
+def main(number=20000):
+    session = Session()
+    session.params = {"api_key": "0" * 32, "format": "json"}
+    session.headers.update({
+        "User-Agent": "Discord.FM benchmark",
+        "Content-Type": "application/json",
+    })
+    cache = cache_handler()
+
+    def prepared_hit():
+        params = {str(key): str(value) for key, value in PARAMS.items()}
+        get = session.prepare_request(Request("GET", BASE_URL, params=params))
+        return cache.get(get.url)
+
+    def key_hit():
+        return cache.get(cache_key(PARAMS, BASE_URL))
+
+    entry = cached_object(exists=True, expire=float("inf"), data={})
+    cache.set(session.prepare_request(Request(
+        "GET",
+        BASE_URL,
+        params={str(key): str(value) for key, value in PARAMS.items()},
+    )).url, entry)
+    cache.set(cache_key(PARAMS, BASE_URL), entry)
+    assert prepared_hit() is entry and key_hit() is entry
+
+    for name, function in (("prepared request", prepared_hit),
+                           ("canonical key", key_hit)):
+        best = min(repeat(function, number=number, repeat=5)) / number
+        print(f"{name:>16}: {best * 1e6:8.2f} us per hit")
+
+
+if __name__ == "__main__":
+    main()
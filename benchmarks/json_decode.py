@@ -0,0 +1,87 @@
+"""
+Compare decoding Last.fm response bodies twice with the stdlib decoder
+(the old get_cached behaviour) against decoding them once with each of
+the installed decoders, using full-page sized `user.getrecenttracks` and
+`user.gettopartists` payloads.
+
+Usage: python -m benchmarks.json_decode
+"""
+from timeit import repeat
+import json
+
+
+from bot.util.decode import decoders
+
+
+def image(size):
+    return {"size": size, "#text": ("https://lastfm.freetls.fastly.net/i/u/"
+                                    "300x300/2a96cbd8b46e442fc41c2b86b821562f"
+                                    ".png")}
+
+
+def images():
+    return [image(size) for size in ("small", "medium", "large", "extralarge")]
+
+
+def recent_tracks(limit=200):
+    tracks = []
+    for index in range(limit):
+        tracks.append({
+            "artist": {"mbid": "b7539c32-53e7-4908-bda3-81449c367da6",
+                       "#text": f"Artist {index}"},
+            "streamable": "0",
+            "image": images(),
+            "mbid": "d2e9a1cd-6c43-4e21-9f39-2b6d8a8b7c2e",
+            "album": {"mbid": "6b7f0a5a-4a1f-4a4c-8d1d-f47b5c3b9b6d",
+                      "#text": f"Album {index}"},
+            "name": f"Track {index}",
+            "url": f"https://www.last.fm/music/Artist+{index}/_/Track+{index}",
+            "date": {"uts": str(1570000000 - index * 240),
+                     "#text": "02 Oct 2019, 07:06"},
+        })
+    tracks[0]["@attr"] = {"nowplaying": "true"}
+    del tracks[0]["date"]
+    return {"recenttracks": {"@attr": {
+        "page": "1", "perPage": str(limit), "user": "LMByrne",
+        "total": "48213", "totalPages": "242"}, "track": tracks}}
+
+
+def top_artists(limit=200):
+    artists = []
+    for index in range(limit):
+        artists.append({
+            "@attr": {"rank": str(index + 1)},
+            "mbid": "b7539c32-53e7-4908-bda3-81449c367da6",
+            "url": f"https://www.last.fm/music/Artist+{index}",
+            "playcount": str(5000 - index * 20),
+            "image": images(),
+            "name": f"Artist {index}",
+            "streamable": "0",
+        })
+    return {"topartists": {"@attr": {
+        "page": "1", "perPage": str(limit), "user": "LMByrne",
+        "total": "2811", "totalPages": "15"}, "artist": artists}}
+
+
+def main(number=50):
+    payloads = (
+        ("user.getrecenttracks", json.dumps(recent_tracks()).encode()),
+        ("user.gettopartists", json.dumps(top_artists()).encode()),
+    )
+    for method, body in payloads:
+        print(f"{method} ({len(body) / 1024:.0f} KiB):")
+
+        def twice():
+            json.loads(body)
+            return json.loads(body)
+
+        cases = [("json x2 (old)", twice)]
+        cases.extend((f"{name} x1", lambda loads=loads: loads(body))
+                     for name, loads in decoders.items())
+        for name, function in cases:
+            best = min(repeat(function, number=number, repeat=5)) / number
+            print(f"{name:>18}: {best * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Time loading a Last.fm cache snapshot and restoring it into a fresh cache,
+as is done by fmPlugin on load.
+
+Usage: python -m benchmarks.snapshot [entries]
+"""
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+import gc
+import os
+import sys
+
+
+from bot.util.cache import cache_handler, cached_object
+from bot.util.records import fm_item
+from bot.util.snapshot import load_snapshot, paused_gc, save_snapshot
+
+
+def build_cache(entries):
+    now = time()
+    cache = cache_handler(max_entries=entries, max_bytes=float("inf"))
+    for index in range(entries):
+        data = [fm_item(
+            f"Track {index}-{position}",
+            artist=f"Artist {index}",
+            url=f"https://www.last.fm/music/Artist+{index}/_/{position}",
+            playcount=str(position),
+            mbid="",
+            uts=int(now) - position * 180,
+        ) for position in range(3)]
+        cache.set(f"user.getrecenttracks:{index}", cached_object(
+            exists=True,
+            expire=now + 600,
+            data=data,
+            size=512,
+            stale=now + 3600,
+            group="user.getrecenttracks",
+        ))
+
+    return cache
+
+
+def main(entries=100000, repeat=5):
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fm-0.pickle")
+        save_snapshot(
+            path,
+            {"packed_cache": build_cache(entries).snapshot()},
+        )
+        print(f"{entries} entries, {os.path.getsize(path) / 1024 ** 2:.1f}"
+              " MiB snapshot")
+        timings = []
+        for _ in range(repeat):
+            cache = cache_handler(max_entries=entries, max_bytes=float("inf"))
+            start = perf_counter()
+            with paused_gc():
+                snapshot = load_snapshot(path)
+                loaded = perf_counter()
+                restored = cache.restore(snapshot["packed_cache"])
+            timings.append((loaded - start, perf_counter() - loaded))
+            assert restored == entries
+            #  Entries are unpickled on their first hit.
+            assert cache.get("user.getrecenttracks:0").data[0].name
+            del cache, snapshot
+            gc.collect()
+
+    load, restore = min(timings, key=sum)
+    print(f"   load: {load:.3f}s\nrestore: {restore:.3f}s\n"
+          f"  total: {load + restore:.3f}s (best of {repeat})")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
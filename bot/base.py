@@ -1,4 +1,5 @@
 from platform import python_version
+from typing import Union
 import logging
 import operator
 import os
@@ -18,8 +19,11 @@ except ImportError:
 
 
 from bot import __GIT__
+from bot.util.breaker import breaker_registry
+from bot.util.http import client as http_client
 from bot.util.react import reactors_handler
-from bot.util.sql import sql_instance
+from bot.util.settings import settings_cache
+from bot.util.sql import filter_index, sql_instance
 
 log = logging.getLogger(__name__)
 
@@ -61,7 +65,7 @@ class api(custom_base):
     user_agent: str = (f"Discord.FM @{__GIT__} "
                        f"Python {python_version()} "
                        f"requests/{__Rversion__}")
-    last_key: str = None
+    last_key: Union[str, list] = None  # a key or a list of keys
     google_key: str = None
     google_cse_engine_ID: str = ("0129851312360258"
                                  "62960:rhlblfpn4hc")
@@ -74,6 +78,105 @@ class api(custom_base):
     discogs_secret: str = None
     default_lyrics_limit: int = 3
     default_period: int = 0
+    cache_max_entries: int = 10000
+    cache_max_bytes: int = 64 * 1024 ** 2
+    cache_path: str = None
+    cache_disk_max_bytes: int = 256 * 1024 ** 2
+    #  Service: [connect, read] timeouts in seconds for outbound requests.
+    timeouts: dict = {
+        "Discogs": [3.05, 5],
+        "Images": [3.05, 15],
+        "Last.fm": [3.05, 10],
+        "Spotify": [3.05, 10],
+        "Status": [3.05, 15],
+        "YouTube": [3.05, 10],
+    }
+    default_timeout: list = [3.05, 10]
+    #  Connections kept alive per host by the shared HTTP client.
+    http_pool_size: int = 32
+    #  Seconds a command's sub-requests have to finish in.
+    command_deadline: float = 15.0
+    #  Circuit breakers open once `breaker_error_rate` of the calls made to
+    #  a service within `breaker_window` seconds fail or are slower than
+    #  `breaker_slow_call`, probing the service after `breaker_reset`.
+    breaker_error_rate: float = 0.5
+    breaker_min_calls: int = 10
+    breaker_window: int = 60
+    breaker_slow_call: float = 10.0
+    breaker_reset: int = 30
+    #  Cache warming from recorded usage, disabled when warm_amount is 0.
+    warm_amount: int = 50
+    warm_methods: list = [
+        "user.getinfo",
+        "user.gettopalbums",
+        "user.gettopartists",
+        "user.gettoptracks",
+    ]
+    warm_peak_hours: int = 3
+    warm_startup_delay: int = 30
+    warm_table_size: int = 1000
+    #  Directory the in-memory caches are snapshotted to on unload.
+    snapshot_dir: str = None
+    snapshot_max_age: int = 3600
+    embed_cache_max_entries: int = 1000
+    embed_cache_ttl: int = 30
+    fan_out_limit: int = 5
+    #  Per key, with rate limited or invalid keys being quarantined.
+    last_rate_limit: float = 5.0
+    last_rate_burst: int = 10
+    last_key_quarantine: int = 300
+    last_invalid_key_quarantine: int = 86400
+    #  Hedge slow Last.fm requests with a duplicate after the rolling p95
+    #  (or last_hedge_min_delay), for up to last_hedge_budget of requests.
+    last_hedging: bool = False
+    last_hedge_budget: float = 0.05
+    last_hedge_min_delay: float = 0.3
+    json_decoder: str = None  # orjson, ujson or json, defaults to fastest
+    #  Last.fm method: seconds a response is cached for, with null meaning
+    #  that it never expires. Methods which aren't listed use the default.
+    cache_ttls: dict = {
+        "album.search": 3600,
+        "artist.getinfo": 3600,
+        "artist.search": 3600,
+        "track.search": 3600,
+        "user.getinfo": 1800,
+        "user.gettopalbums": 300,
+        "user.gettopartists": 300,
+        "user.gettoptracks": 300,
+    }
+    cache_default_ttl: int = 300
+    cache_negative_ttl: int = 1800
+    #  user.getrecenttracks is cached for a fraction of the time since the
+    #  user's last scrobble, within these bounds, with now playing lookups
+    #  (for up to `cache_recent_live_limit` tracks) and responses with a now
+    #  playing track always using the minimum.
+    cache_recent_min_ttl: int = 30
+    cache_recent_max_ttl: int = 300
+    cache_recent_ttl_factor: float = 0.1
+    cache_recent_live_limit: int = 2
+    #  Lookups by these parameters never expire, as their responses don't
+    #  change (as with closed time ranges).
+    cache_immutable_params: list = ["mbid"]
+    #  Last.fm method: seconds an expired entry can be served for whilst
+    #  it's refreshed in the background or whilst Last.fm is failing.
+    cache_revalidate: dict = {
+        "artist.getinfo": 86400,
+        "user.getinfo": 3600,
+        "user.gettopalbums": 3600,
+        "user.gettopartists": 3600,
+        "user.gettoptracks": 3600,
+    }
+    cache_stale_if_error: dict = {
+        "album.search": 86400,
+        "artist.getinfo": 86400,
+        "artist.search": 86400,
+        "track.search": 86400,
+        "user.getinfo": 86400,
+        "user.getrecenttracks": 600,
+        "user.gettopalbums": 86400,
+        "user.gettopartists": 86400,
+        "user.gettoptracks": 86400,
+    }
 
 
 class sql(custom_base):
@@ -86,6 +189,22 @@ class sql(custom_base):
     query: dict = {"charset": "utf8mb4"}
     args: dict = None
     local_path: str = "data/data.db"
+    #  Queue writes and flush them in batches of up to `write_batch_size`
+    #  rows, at most `write_batch_delay` seconds after they're made.
+    write_behind: bool = False
+    write_batch_size: int = 100
+    write_batch_delay: float = 5.0
+    #  Failed queries are retried with a jittered exponential backoff,
+    #  starting at `retry_base_delay` seconds and capped at `retry_max_delay`.
+    retry_attempts: int = 5
+    retry_base_delay: float = 0.1
+    retry_max_delay: float = 2.0
+    #  Queries fail fast for `unhealthy_reset` seconds once
+    #  `unhealthy_error_rate` of the queries in the last minute have failed.
+    unhealthy_error_rate: float = 0.5
+    unhealthy_min_calls: int = 5
+    unhealthy_slow_query: float = 5.0
+    unhealthy_reset: int = 15
 
 
 class embed_values(custom_base):
@@ -147,6 +266,10 @@ class config(custom_base):
     monitor_usage: int = None
     no_exception_response: bool = False
     about_links: dict = {}
+    #  Guilds received on connect are loaded from SQL in batches of up to
+    #  `guild_batch_size`, at most `guild_batch_delay` seconds after arriving.
+    guild_batch_size: int = 500
+    guild_batch_delay: float = 1.0
     api: api = api()
     disco: disco = disco()
     sql: sql = sql()
@@ -155,10 +278,13 @@ class config(custom_base):
 
 class bot_frame:
     __slots__ = (
+        "breakers",
         "config",
         "config_meta",
+        "filters",
+        "guild_settings",
         "help_embeds",
-        "prefix_cache",
+        "http",
         "reactor",
         "sql",
     )
@@ -175,8 +301,23 @@ class bot_frame:
     def __init__(self, config_path=None, raw_config=None):
         self.config = config(**(raw_config or self.get_config(config_path)))
         self.sql = sql_instance(**self.config.sql.to_dict())
+        self.filters = filter_index(self.sql)
         self.reactor = reactors_handler()
-        self.prefix_cache = {}
+        self.breakers = breaker_registry(
+            error_rate=self.config.api.breaker_error_rate,
+            min_calls=self.config.api.breaker_min_calls,
+            window=self.config.api.breaker_window,
+            slow_call=self.config.api.breaker_slow_call,
+            reset_timeout=self.config.api.breaker_reset,
+        )
+        self.http = http_client
+        self.http.configure(
+            user_agent=self.config.api.user_agent,
+            timeouts=self.config.api.timeouts,
+            default_timeout=self.config.api.default_timeout,
+            pool_maxsize=self.config.api.http_pool_size,
+        )
+        self.guild_settings = settings_cache(self.sql)
 
     def generic_embed(self, **kwargs):
         for key, value in self.config.embed_values.to_dict().items():
@@ -228,6 +369,26 @@ class bot_frame:
         with open(config_path, "w") as file:
             handlers[0](data, file, indent=4)
 
+    def snapshot_path(self, name, shard_id=0):
+        """
+        Get the path of a shard's snapshot file,
+        returning None if snapshots are disabled.
+        """
+        directory = self.config.api.snapshot_dir
+        if not directory:
+            return
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return os.path.join(directory, f"{name}-{shard_id}.pickle")
+
+    def timeout(self, service, deadline=None):
+        """
+        Get a service's (connect, read) timeout,
+        clamped to the time left before `deadline` if passed.
+        """
+        return self.http.timeout(service, deadline)
+
     @property
     def prefix(self):
         return self.config.disco.bot.commands_prefix or "fm."
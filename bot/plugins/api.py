@@ -8,11 +8,14 @@ from disco.bot import Plugin
 from disco.bot.command import CommandError
 from disco.types.permissions import Permissions
 from disco.util.sanitize import S as sanitize
+from gevent import Timeout
 from lyrics_extractor import Song_Lyrics
-from requests import get, post
+from requests import RequestException
 
 
 from bot.base import bot
+from bot.util.breaker import circuitOpen, server_error
+from bot.util.deadline import deadlineExceeded
 from bot.util.misc import api_loop, exception_webhooks, redact
 from bot.util.react import generic_react
 
@@ -22,7 +25,6 @@ class ApiPlugin(Plugin):
         super(ApiPlugin, self).load(ctx)
         bot.config.api.get(
             self,
-            "user_agent",
             "google_key",
             "spotify_ID",
             "spotify_secret",
@@ -48,11 +50,9 @@ class ApiPlugin(Plugin):
         if event.channel.is_dm:
             limit = 6
         else:
-            guild = bot.sql(bot.sql.guilds.query.get, event.guild.id)
-            if not guild or guild.lyrics_limit is None:
+            limit = bot.guild_settings.get(event.guild.id).lyrics_limit
+            if limit is None:
                 limit = bot.config.api.default_lyrics_limit
-            else:
-                limit = guild.lyrics_limit
             if limit <= 0:
                 return api_loop(
                     event.channel.send_message,
@@ -63,7 +63,23 @@ class ApiPlugin(Plugin):
             event.channel.send_message,
             "Searching for lyrics...",
         )
-        title, lyrics = self.lyrics.get_lyrics(quote_plus(content))
+        #  The lyrics client doesn't take a timeout,
+        #  so it's bounded by the command's deadline instead.
+        try:
+            with Timeout(
+                    bot.config.api.command_deadline,
+                    deadlineExceeded("Lyrics took too long to respond.")):
+                title, lyrics = bot.breakers("Lyrics").call(
+                    self.lyrics.get_lyrics,
+                    quote_plus(content),
+                )
+        except (circuitOpen, deadlineExceeded) as e:
+            try:
+                return api_loop(first_message.edit, str(e))
+            except APIException as e:
+                if e.code in (10003, 10005, 10008):
+                    return
+                raise e
 
         if not lyrics:
             content = sanitize(content, escape_codeblocks=True)
@@ -137,16 +153,7 @@ class ApiPlugin(Plugin):
                         "The limit can only be between 0 and 8.",
                     )
 
-                guild = bot.sql(bot.sql.guilds.query.get, event.guild.id)
-                if not guild:
-                    guild = bot.sql.guilds(
-                        guild_id=event.guild_id,
-                        lyrics_limit=limit,
-                    )
-                    bot.sql.add(guild)
-                else:
-                    guild.lyrics_limit = limit
-                    bot.sql.flush()
+                bot.guild_settings.set(event.guild.id, lyrics_limit=limit)
                 api_loop(
                     event.channel.send_message,
                     f"Changed lyric response embed limit to {limit}.",
@@ -157,10 +164,8 @@ class ApiPlugin(Plugin):
                     "This command is limited to server admins.",
                 )
         else:
-            guild = bot.sql(bot.sql.guilds.query.get, event.guild.id)
-            if guild and guild.lyrics_limit is not None:
-                limit = guild.lyrics_limit
-            else:
+            limit = bot.guild_settings.get(event.guild.id).lyrics_limit
+            if limit is None:
                 limit = bot.config.api.default_lyrics_limit
             api_loop(
                     event.channel.send_message,
@@ -183,18 +188,25 @@ class ApiPlugin(Plugin):
         if not search or sp_type not in ("track", "album", "artist", "playlist"):
             search = f"{sp_type} {search}".strip(" ")
             sp_type = "track"
-        r = get(
-            "https://api.spotify.com/v1/search",
-            params={
-                "q": search,
-                "type": sp_type,
-            },
-            headers={
-                "Authorization": f"Bearer {self.spotify_auth}",
-                "User-Agent": self.user_agent,
-                "Content-Type": "application/json",
-            },
-        )
+        try:
+            r = bot.breakers("Spotify").call(
+                bot.http.get,
+                "https://api.spotify.com/v1/search",
+                service="Spotify",
+                params={
+                    "q": search,
+                    "type": sp_type,
+                },
+                headers={
+                    "Authorization": f"Bearer {self.spotify_auth}",
+                    "Content-Type": "application/json",
+                },
+                failed=server_error,
+            )
+        except RequestException as e:
+            self.log.warning(e)
+            raise CommandError("Spotify isn't available right now.")
+
         if r.status_code == 200:
             if not r.json()[sp_type+"s"]["items"]:
                 search = sanitize(search, escape_codeblocks=True)
@@ -242,14 +254,19 @@ class ApiPlugin(Plugin):
             f"{self.spotify_ID}:{self.spotify_secret}".encode()
         ).decode()
         r_time = time()
-        r = post(
-            "https://accounts.spotify.com/api/token",
-            data={"grant_type": "client_credentials"},
-            headers={
-                "Authorization": f"Basic {auth}",
-                "User-Agent": self.user_agent,
-            },
-        )
+        try:
+            r = bot.breakers("Spotify").call(
+                bot.http.post,
+                "https://accounts.spotify.com/api/token",
+                service="Spotify",
+                data={"grant_type": "client_credentials"},
+                headers={"Authorization": f"Basic {auth}"},
+                failed=server_error,
+            )
+        except RequestException as e:
+            self.log.warning(e)
+            raise CommandError("Spotify isn't available right now.")
+
         if r.status_code != 200:
             self.log.warning(redact(str(r.text)))
             if bot.config.exception_webhooks:
@@ -296,20 +313,25 @@ class ApiPlugin(Plugin):
         if not content or yt_type not in yt_types_indexs:
             content = f"{yt_type} {content}".strip(" ")
             yt_type = "video"
-        r = get(
-            "https://www.googleapis.com/youtube/v3/search",
-            params={
-                "part": "snippet",
-                "maxResults": 50,
-                "key": self.google_key,
-                "type": yt_type,
-                "q": content,
-            },
-            headers={
-                "User-Agent": self.user_agent,
-                "Content-Type": "application/json",
-            },
-        )
+        try:
+            r = bot.breakers("YouTube").call(
+                bot.http.get,
+                "https://www.googleapis.com/youtube/v3/search",
+                service="YouTube",
+                params={
+                    "part": "snippet",
+                    "maxResults": 50,
+                    "key": self.google_key,
+                    "type": yt_type,
+                    "q": content,
+                },
+                headers={"Content-Type": "application/json"},
+                failed=server_error,
+            )
+        except RequestException as e:
+            self.log.warning(e)
+            raise CommandError("YouTube isn't available right now.")
+
         if r.status_code == 200:
             if r.json()["pageInfo"]["totalResults"] != 0:
                 response = r.json()["items"][0]["id"][
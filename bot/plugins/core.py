@@ -21,6 +21,7 @@ from bot.util.misc import (
     api_loop, dm_default_send, exception_webhooks,
     exception_dms, redact
 )
+from bot.util.snapshot import load_snapshot, save_snapshot
 
 
 class CorePlugin(Plugin):
@@ -28,14 +29,35 @@ class CorePlugin(Plugin):
         super(CorePlugin, self).load(ctx)
         bot.load_help_embeds(self)
         self.process = psutil.Process()
-        try:
-            for guild in bot.sql(bot.sql.guilds.query.all):
-                bot.prefix_cache[guild.guild_id] = guild.prefix
+        self.snapshot_path = bot.snapshot_path(
+            "core",
+            self.bot.client.config.shard_id,
+        )
+        snapshot = self.snapshot_path and load_snapshot(
+            self.snapshot_path,
+            max_age=bot.config.api.snapshot_max_age,
+        )
+        if snapshot and "guild_settings" in snapshot:
+            bot.guild_settings.settings.update(snapshot["guild_settings"])
+            self.log.info(f"Restored {len(snapshot['guild_settings'])} "
+                          "guild settings from snapshot.")
+
+        #  Guild data is loaded in batches as GuildCreate events arrive,
+        #  so that only this shard's guilds are loaded.
+        self.pending_guilds = set()
+        self.register_schedule(
+            self.load_pending_guilds,
+            bot.config.guild_batch_delay,
+            init=False,
+        )
 
+        #  Otherwise loaded by the first command check.
+        try:
+            bot.filters.load()
         except CommandError as e:
-            self.log.critical("Failed to load guild data from SQL "
+            self.log.critical("Failed to load the filter from SQL "
                               "servers, they're probably down.")
-            log.exception(e.original_exception)
+            self.log.exception(e.original_exception)
 
         if bot.config.monitor_usage:
             if not os.path.exists("data/status/"):
@@ -51,6 +73,11 @@ class CorePlugin(Plugin):
 
     def unload(self, ctx):
         bot.unload_help_embeds(self)
+        if self.snapshot_path:
+            save_snapshot(
+                self.snapshot_path,
+                {"guild_settings": bot.guild_settings.settings},
+            )
         while bot.reactor.events:
             event = list(bot.reactor.events.values())[0]
             try:
@@ -75,14 +102,36 @@ class CorePlugin(Plugin):
 
     @Plugin.listen("GuildCreate")
     def on_guild_join(self, event):
-        if event.unavailable is UNSET:
-            guild = bot.sql(bot.sql.guilds.query.get, event.guild.id)
-            bot.prefix_cache[event.guild.id] = guild.prefix if guild else None
+        #  Guilds that are joined are always reloaded, whereas guilds that
+        #  become available are only loaded if they weren't in the snapshot.
+        if (event.unavailable is UNSET or
+                event.guild.id not in bot.guild_settings):
+            self.pending_guilds.add(event.guild.id)
+            if len(self.pending_guilds) >= bot.config.guild_batch_size:
+                self.load_pending_guilds()
+
+    def load_pending_guilds(self):
+        """
+        Load the data of the guilds queued by GuildCreate
+        in batches of `guild_batch_size` guilds per query.
+        """
+        while self.pending_guilds:
+            batch = set()
+            while (self.pending_guilds and
+                   len(batch) < bot.config.guild_batch_size):
+                batch.add(self.pending_guilds.pop())
+
+            try:
+                bot.guild_settings.load(batch)
+            except CommandError as e:
+                #  These'll be loaded individually when they're used.
+                return self.log.warning("Failed to load the data of "
+                                        f"{len(batch)} guilds: {e.msg}")
 
     @Plugin.listen("GuildDelete")
     def on_guild_leave(self, event):
         if event.unavailable is UNSET:
-            bot.prefix_cache.pop(event.id, None)
+            bot.guild_settings.pop(event.id)
             guild = bot.sql(bot.sql.guilds.query.get, event.id)
             if guild:
                 bot.sql.delete(guild)
@@ -107,7 +156,7 @@ class CorePlugin(Plugin):
                     event.channel.send_message,
                     "Guild data removed.",
                 )
-                bot.prefix_cache.pop(event.guild.id, None)
+                bot.guild_settings.pop(event.guild.id)
         else:
             api_loop(
                 event.channel.send_message,
@@ -286,11 +335,9 @@ class CorePlugin(Plugin):
             )
 
         if prefix is None:
-            guild = bot.sql(bot.sql.guilds.query.get, event.guild.id)
-            if not guild or guild.prefix is None:
+            prefix = bot.guild_settings.get(event.guild.id).prefix
+            if prefix is None:
                 prefix = bot.prefix
-            else:
-                prefix = guild.prefix
             api_loop(
                 event.channel.send_message,
                 f"The prefix is set to ``{prefix}``",
@@ -305,17 +352,7 @@ class CorePlugin(Plugin):
                 )
 
             new_prefix = prefix if prefix != bot.prefix else None
-            guild = bot.sql(bot.sql.guilds.query.get, event.guild.id)
-            if guild is None and new_prefix is not None:
-                guild = bot.sql.guilds(
-                    guild_id=event.guild.id,
-                    prefix=new_prefix,
-                )
-                bot.sql.add(guild)
-            elif guild:
-                guild.prefix = new_prefix
-                bot.sql.flush()
-            bot.prefix_cache[event.guild.id] = new_prefix
+            bot.guild_settings.set(event.guild.id, prefix=new_prefix)
             api_loop(
                 event.channel.send_message,
                 f"Prefix changed to ``{prefix}``",
@@ -422,15 +459,13 @@ class CorePlugin(Plugin):
             if event.channel.is_dm:
                 return bot.prefix
 
-            #  check prefix cache return default prefix if is None
-            prefix = bot.prefix_cache.get(event.guild_id, UNSET)
-            if prefix is not UNSET:
-                return bot.prefix if prefix is None else prefix
+            #  load the guild's batch early if it's still queued
+            if event.guild_id in self.pending_guilds:
+                self.load_pending_guilds()
 
-            #  check sql and cache value returned or default
-            guild = bot.sql(bot.sql.guilds.query.get, event.guild_id)
-            bot.prefix_cache[event.guild_id] = guild.prefix if guild else None
-            return bot.prefix if not guild or guild.prefix is None else guild.prefix
+            #  return the default prefix if the guild's is None
+            prefix = bot.guild_settings.get(event.guild_id).prefix
+            return bot.prefix if prefix is None else prefix
 
         def get_missing_perms(PermissionValue, self_perms):
             perms = [perm for perm in Permissions.keys()
@@ -442,6 +477,14 @@ class CorePlugin(Plugin):
         if event.author.bot:
             return
 
+        #  Enforce guild/channel and user filters before matching commands.
+        try:
+            if not bot.filters.allowed(
+                    channel=event.channel, user=event.author):
+                return
+        except CommandError as e:  # The filter couldn't be loaded.
+            return self.log.warning(f"Dropped message: {e.msg}")
+
         prefix = get_prefix(event)
         require_mention = self.bot.config.commands_require_mention
         if not event.message.content.startswith(prefix):
@@ -476,15 +519,6 @@ class CorePlugin(Plugin):
                          f"{get_missing_perms(PermissionValue, self_perms)}`"),
                     )
 
-            #  Enforce guild/channel and user whitelist.
-            CStatus = bot.sql.softget(
-                bot.sql.cfilter, channel=event.channel)[0]
-            AStatus = bot.sql.softget(bot.sql.cfilter, user=event.author)[0]
-            if (CStatus.blacklist_status() or AStatus.blacklist_status()
-                    or not CStatus.whitelist_status()
-                    or not AStatus.whitelist_status()):
-                return
-
             command.plugin.execute(CommandEvent(command, event, match))
             break
 
@@ -1,30 +1,49 @@
-from time import time, strftime, gmtime
-from json.decoder import JSONDecodeError
+from functools import partial
+from time import time, strftime, gmtime, monotonic
 import re
 
 
+from disco.api.http import APIException
 from disco.bot import Plugin
 from disco.bot.command import CommandError
 from disco.types.permissions import Permissions
 from disco.util.sanitize import S as sanitize
-from requests import get, Session, Request
+from gevent import joinall, spawn, wait
+from gevent.pool import Pool
 from requests.exceptions import ConnectionError as requestCError
+from requests.exceptions import Timeout as requestTimeout
 
 
 from bot.base import bot
+from bot.util.breaker import circuitOpen, server_error
+from bot.util.cache import (
+    cache_handler, cache_key, cached_object, describe_key, disk_cache,
+    key_matches, single_flight, ttl_policy,
+)
+from bot.util.deadline import deadline, deadlineExceeded
+from bot.util.decode import get_decoder
+from bot.util.hedge import hedge_budget, latency_window
 from bot.util.misc import (
-    api_loop, AT_to_id, get_dict_item,
+    api_loop, AT_to_id,
     redact, user_regex as discord_regex,
     exception_webhooks, time_since
 )
+from bot.util.ratelimit import key_pool, priorities
 from bot.util.react import generic_react
+from bot.util.records import project, sizeof
+from bot.util.snapshot import load_snapshot, paused_gc, save_snapshot
 from bot.util.sql import periods
+from bot.util.usage import frequency_table
 
 
 class fmEntryNotFound(CommandError):
     """Last.fm entry not found."""
 
 
+class fmUnavailable(CommandError):
+    """Last.fm is unavailable or failed to handle the request."""
+
+
 class fmPlugin(Plugin):
     def load(self, ctx):
         super(fmPlugin, self).load(ctx)
@@ -38,33 +57,158 @@ class fmPlugin(Plugin):
             "discogs_secret",
             "discogs_key",
         )
-        self.cache = {}
+        self.cache = cache_handler(
+            max_entries=bot.config.api.cache_max_entries,
+            max_bytes=bot.config.api.cache_max_bytes,
+        )
+        self.in_flight = single_flight()
+        #  Rendered command embeds, keyed by command, user and arguments.
+        self.embeds = cache_handler(
+            max_entries=bot.config.api.embed_cache_max_entries,
+        )
+        self.rendering = single_flight()
+        self.loads = get_decoder(bot.config.api.json_decoder)
+        keys = bot.config.api.last_key
+        self.keys = key_pool(
+            keys if isinstance(keys, list) else [keys],
+            rate=bot.config.api.last_rate_limit,
+            burst=bot.config.api.last_rate_burst,
+            rate_limit_quarantine=bot.config.api.last_key_quarantine,
+            invalid_quarantine=bot.config.api.last_invalid_key_quarantine,
+        )
+        self.latency = latency_window()
+        self.hedges = hedge_budget(bot.config.api.last_hedge_budget)
+        self.disk_cache = None
+        if bot.config.api.cache_path:
+            self.disk_cache = disk_cache(
+                bot.config.api.cache_path,
+                max_bytes=bot.config.api.cache_disk_max_bytes,
+            )
+            self.register_schedule(
+                self.disk_cache.compact,
+                3600,
+                repeat=True,
+                init=False,
+            )
+        self.ttls = ttl_policy(
+            ttls=bot.config.api.cache_ttls,
+            default=bot.config.api.cache_default_ttl,
+            negative=bot.config.api.cache_negative_ttl,
+            recent_min=bot.config.api.cache_recent_min_ttl,
+            recent_max=bot.config.api.cache_recent_max_ttl,
+            recent_factor=bot.config.api.cache_recent_ttl_factor,
+            live_limit=bot.config.api.cache_recent_live_limit,
+            immutable_params=bot.config.api.cache_immutable_params,
+        )
         self.cool_downs = {"fulluser": {}, "friends": []}
-        self.s = Session()
-        self.s.params = {
-            "api_key": bot.config.api.last_key,
-            "format": "json",
-        }
-        self.s.headers.update({
-            "User-Agent": bot.config.api.user_agent,
-            "Content-Type": "application/json",
-        })
+        #  Recorded interactive requests and the hours they're made in,
+        #  used to warm the cache with the hottest users' data.
+        self.usage = frequency_table(bot.config.api.warm_table_size)
+        self.usage_hours = frequency_table(24)
+        self.warmed_hour = None
+        self.snapshot_path = bot.snapshot_path(
+            "fm",
+            self.bot.client.config.shard_id,
+        )
+        if self.snapshot_path:
+            self.restore_snapshot()
+        if bot.config.api.warm_amount:
+            self.register_schedule(
+                self.warm_cache,
+                bot.config.api.warm_startup_delay,
+                repeat=False,
+                init=False,
+            )
         self.BASE_URL = "https://ws.audioscrobbler.com/2.0/"
 
     def unload(self, ctx):
         bot.unload_help_embeds(self)
+        if self.snapshot_path:
+            save_snapshot(self.snapshot_path, {
+                "packed_cache": self.cache.snapshot(),
+                "cool_downs": self.cool_downs,
+                "usage": self.usage,
+                "usage_hours": self.usage_hours,
+            })
+        if self.disk_cache:
+            self.disk_cache.close()
         super(fmPlugin, self).unload(ctx)
 
     @staticmethod
     def __check__():
         return bot.config.api.last_key
 
-    @Plugin.schedule(180)
+    def restore_snapshot(self):
+        start = time()
+        #  The collector's paused for both so that it doesn't scan the
+        #  restored entries between loading and restoring them.
+        with paused_gc():
+            snapshot = load_snapshot(self.snapshot_path)
+            if snapshot is None:
+                return
+
+            #  Caches from before entries were packed are skipped.
+            restored = self.cache.restore(snapshot.get("packed_cache", ()))
+        self.cool_downs.update(snapshot["cool_downs"])
+        self.usage = snapshot.get("usage", self.usage)
+        self.usage.max_size = bot.config.api.warm_table_size
+        self.usage_hours = snapshot.get("usage_hours", self.usage_hours)
+        self.log.info(f"Restored {restored} cache entries from snapshot "
+                      f"in {time() - start:.3f}s.")
+
+    @Plugin.schedule(30)
     def purge_cache(self):
         self.log.debug("Purging cache.")
-        for url, cache_obj in self.cache.copy().items():
-            if cache_obj.expired_check():
-                del self.cache[url]
+        self.cache.purge_expired()
+        self.embeds.purge_expired()
+
+    @Plugin.schedule(3600, init=False)
+    def decay_usage(self):
+        self.usage.decay(0.9)
+        #  Hours are decayed daily so that they keep a full day's shape.
+        if gmtime().tm_hour == 0:
+            self.usage_hours.decay(0.5)
+
+    @Plugin.schedule(300, init=False)
+    def check_peak(self):
+        """
+        Warm the cache shortly before the start of a peak hour.
+        """
+        now = gmtime()
+        if (not bot.config.api.warm_amount or now.tm_min < 50 or
+                self.warmed_hour == now.tm_hour):
+            return
+
+        peaks = self.usage_hours.hottest(bot.config.api.warm_peak_hours)
+        if (now.tm_hour + 1) % 24 in (hour for hour, _ in peaks):
+            self.warmed_hour = now.tm_hour
+            spawn(self.warm_cache)
+
+    def warm_cache(self):
+        """
+        Pre-fetch the most requested Last.fm user data through the bulk
+        queue, stopping as soon as interactive requests need the quota.
+        """
+        warmed = 0
+        for key, _ in self.usage.hottest(bot.config.api.warm_amount):
+            if self.keys.contended(priorities.BULK):
+                self.log.info("Stopped warming the cache for "
+                              "interactive requests.")
+                break
+
+            cached = self.cache.get(key)
+            if cached is not None and not cached.expired_check():
+                continue
+
+            url, params = self.usage.values[key]
+            try:
+                self.get_cached(params, url=url, priority=priorities.BULK)
+            except CommandError as e:
+                self.log.debug(f"Failed to warm {describe_key(key)}: {e}")
+            else:
+                warmed += 1
+
+        self.log.info(f"Warmed {warmed} cache entries.")
 
     @Plugin.command("add", "<alias:str...>", group="alias", metadata={"help": "last.fm"})
     def on_alias_set_command(self, event, alias):
@@ -147,6 +291,8 @@ class fmPlugin(Plugin):
                 "Alias commands are guild specific.",
             )
 
+        #  Relationships are loaded outside of the write queue's syncing.
+        bot.sql.drain()
         target = self.get_user_info(target or event.author.id, event.channel)
         data = [alias for alias in target.aliases
                 if alias.guild_id == event.guild.id]
@@ -176,6 +322,17 @@ class fmPlugin(Plugin):
         """
         Get an artist's info on Last.fm.
         """
+        artist_embed = self.get_embed(
+            "artist info",
+            partial(self.render_artist, artist),
+            artist=artist.lower(),
+        )
+        if artist_embed is None:
+            return api_loop(event.channel.send_message, "Artist not found.")
+
+        api_loop(event.channel.send_message, embed=artist_embed)
+
+    def render_artist(self, artist):
         #  Make request
         params = {"method": "artist.getinfo"}
         if self.mbid_reg.fullmatch(artist):
@@ -183,28 +340,37 @@ class fmPlugin(Plugin):
         else:
             params.update({"artist": artist.lower()})
 
-        response = self.get_cached(params, cool_down=3600, item="artist")
+        cutoff = self.start_deadline()
+        response, artwork = self.fan_out(
+            partial(self.get_cached, params, item="artist", cutoff=cutoff),
+            partial(self.get_artwork, artist, "artist", cutoff=cutoff),
+            return_exceptions=True,
+            cutoff=cutoff,
+        )
+        if isinstance(response, BaseException):
+            raise response
+
+        #  The thumbnail's optional, so it's left out if it failed
+        #  or didn't finish in time.
+        if isinstance(artwork, BaseException):
+            artwork = None
+
         #  Check for error message.
-        artist_data = response.get("artist")
-        if not artist_data:
-            response = response.get("message")
-            if not response:
-                response = "Unknown error occured."
-                log.warning(f"Failed to get artist error: {artist}")
-            return api_loop(event.channel.send_message, response)
+        if not response:
+            self.log.warning(f"Failed to get artist: {artist}")
+            return
 
         fields = [
-            {"name": "Listeners", "value": artist_data["stats"]["listeners"]},
-            {"name": "Play Count", "value": artist_data["stats"]["playcount"]},
-            {"name": "On-Tour", "value": str(bool(artist_data["ontour"]))},
+            {"name": "Listeners", "value": response.listeners},
+            {"name": "Play Count", "value": response.playcount},
+            {"name": "On-Tour", "value": str(bool(response.ontour))},
         ]
-        artist_embed = bot.generic_embed(
-            title=artist_data["name"],
-            url=artist_data["url"],
-            thumbnail={"url": self.get_artwork(artist, "artist")},
+        return bot.generic_embed(
+            title=response.name,
+            url=response.url,
+            thumbnail={"url": artwork},
             fields=[{**field, "inline": False} for field in fields],
         )
-        api_loop(event.channel.send_message, embed=artist_embed)
 
     @Plugin.command("chart")
     def on_chart_command(self, event):
@@ -217,6 +383,8 @@ class fmPlugin(Plugin):
         Get a list of what your friends have recently listened to.
         Accepts no arguments.
         """
+        #  Relationships are loaded outside of the write queue's syncing.
+        bot.sql.drain()
         user = bot.sql(bot.sql.users.query.get, event.author.id)
         if not user or not user.friends:
             api_loop(
@@ -232,14 +400,16 @@ class fmPlugin(Plugin):
                 "thumbnail": {"url": event.author.avatar_url},
             }
             data = [f.slave_id for f in user.friends]
+            paginated = len(data) > 5 and not event.channel.is_dm
             content, embed = self.friends_search(
                 data,
                 0,
                 owner=event.author.id,
+                prefetch=paginated,
                 **kwargs,
             )
             reply = api_loop(event.channel.send_message, content, embed=embed)
-            if len(data) > 5 and not event.channel.is_dm:
+            if paginated:
                 bot.reactor.init_event(
                     message=reply,
                     owner=event.author.id,
@@ -247,6 +417,7 @@ class fmPlugin(Plugin):
                     index=0,
                     amount=5,
                     edit_message=self.friends_search,
+                    prefetch=True,
                     **kwargs
                 )
                 bot.reactor.add_reactors(
@@ -259,63 +430,107 @@ class fmPlugin(Plugin):
                     "\N{black rightwards arrow}",
                 )
 
-    def friends_search(self, data, index, owner, limit=5, **kwargs):
+    def friends_search(
+            self,
+            data,
+            index,
+            owner,
+            limit=5,
+            prefetch=False,
+            **kwargs):
         embed = bot.generic_embed(**kwargs)
-        if len(data) - index < limit:
-            limit = len(data) - index
-        for x in range(limit):
-            current_index = index + x
-            while True:
-                user = self.state.users.get(int(data[current_index]))
-                user = str(user) if user else data[current_index]
-                friend = self.get_user_info(data[current_index])
-                if not friend.last_username:
-                    bot.sql(bot.sql.friends.query.filter_by(
-                        master_id=owner,
-                        slave_id=data[current_index]
-                    ).delete)
-                    bot.sql.flush()
-                    data.pop(current_index)
-                    if current_index >= len(data):
-                        finished = True
-                        break
-                else:
-                    finished = False
-                    break
-
-            if finished:
-                break
-
-            friend = friend.last_username
-            limit = 2
-            params = {
-                "method": "user.getrecenttracks",
-                "user": friend,
-                "limit": limit,
-            }
-            try:
-                self.get_fm_secondary(
-                    embed=embed,
-                    params=params,
-                    data_map=("recenttracks", "track"),
-                    artist_map=("artist", "#text"),
-                    name_format=(f"raw:[{current_index + 1}]"
-                                 f" {user} ({friend})", ),
-                    value_format=("ago", "artist"),
-                    value_clamps=("ago", ),
-                    limit=limit,
-                )
-            except CommandError:
+        friends = self.get_friends_page(data, index, owner, limit=limit)
+        cutoff = self.start_deadline()
+        responses = self.fan_out(
+            *(partial(
+                self.get_cached,
+                self.friend_params(friend),
+                cutoff=cutoff,
+            ) for _, _, friend in friends),
+            return_exceptions=True,
+            cutoff=cutoff,
+        )
+        for (position, user, friend), response in zip(friends, responses):
+            if isinstance(response, CommandError):
                 embed.add_field(
-                    name=f"[{current_index + 1}] {user}",
+                    name=f"[{position + 1}] {user}",
                     value=f"Unable to access Last.fm account `{friend}`.",
                     inline=False,
                 )
-            if current_index >= len(data) - 1:
-                break
+                continue
+
+            if isinstance(response, BaseException):
+                raise response
+
+            self.get_fm_secondary(
+                embed=embed,
+                params=self.friend_params(friend),
+                name_format=(f"raw:[{position + 1}] {user} ({friend})", ),
+                value_format=("ago", "artist"),
+                value_clamps=("ago", ),
+                limit=2,
+                response=response,
+            )
+
+        #  Warm the cache for the next page while the reactor is active.
+        if prefetch and friends and friends[-1][0] + 1 < len(data):
+            next_index = friends[-1][0] + 1
+            spawn(self.prefetch_friends, data[next_index:next_index + limit])
 
         return None, embed
 
+    def get_friends_page(self, data, index, owner, limit=5):
+        """
+        Get the position, Discord name and Last.fm username of
+        the friends on a page, removing any friends that no longer have
+        a Last.fm username set from both `data` and the database.
+        """
+        friends = []
+        position = index
+        while len(friends) < limit and position < len(data):
+            friend = self.get_user_info(data[position])
+            if not friend.last_username:
+                bot.sql(bot.sql.friends.query.filter_by(
+                    master_id=owner,
+                    slave_id=data[position],
+                ).delete)
+                bot.sql.flush()
+                data.pop(position)
+                continue
+
+            user = self.state.users.get(int(data[position]))
+            user = str(user) if user else data[position]
+            friends.append((position, user, friend.last_username))
+            position += 1
+
+        return friends
+
+    def prefetch_friends(self, targets):
+        calls = []
+        for target in targets:
+            try:
+                friend = self.get_user_info(target)
+            except CommandError as e:
+                self.log.debug(f"Failed to prefetch friend {target}: {e}")
+                continue
+
+            if friend.last_username:
+                calls.append(partial(
+                    self.get_cached,
+                    self.friend_params(friend.last_username),
+                    priority=priorities.BACKGROUND,
+                ))
+
+        self.fan_out(*calls, return_exceptions=True)
+
+    @staticmethod
+    def friend_params(username):
+        return {
+            "method": "user.getrecenttracks",
+            "user": username,
+            "limit": 2,
+        }
+
     @Plugin.command("friends add", "<target:str...>", metadata={"help": "last.fm"})
     def on_friends_add_command(self, event, target):
         """
@@ -332,10 +547,13 @@ class fmPlugin(Plugin):
         target = target.user_id
         name = self.state.users.get(int(target))
         name = str(name) if name else target
+        #  This bypasses the write queue, as it'd detach the user and
+        #  lose the changes made to their friends.
+        bot.sql.drain()
         user = bot.sql(bot.sql.users.query.get, event.author.id)
         if not user:
             user = bot.sql.users(user_id=event.author.id)
-            bot.sql.add(user)
+            bot.sql.add(user, immediate=True)
         if not any(f.slave_id == target for f in user.friends):
             if (event.channel.is_dm or not
                     event.channel.guild.get_member(target)):
@@ -358,7 +576,7 @@ class fmPlugin(Plugin):
                 event.channel.send_message,
                 f"Removed user ``{name}`` from friends list.",
             )
-        bot.sql.flush()
+        bot.sql.flush(immediate=True)
 
     @Plugin.command(
         "artists",
@@ -367,12 +585,11 @@ class fmPlugin(Plugin):
         metadata={"help": "last.fm", "perms": Permissions.EMBED_LINKS},
         context={
             "method": "artist.search",
-            "data_map": ("results", "artistmatches", "artist"),
             "artwork_type": "Artist",
             "meta_type": "artist",
-            "names": (("name", ), ),
+            "names": ("name", ),
             "name_format": "[{}]: {}",
-            "values": (("listeners", ), ("mbid", )),
+            "values": ("listeners", "mbid"),
             "value_format": "Listeners: {}, MBID: {}",
             "item": "Artist",
         })
@@ -383,12 +600,11 @@ class fmPlugin(Plugin):
         metadata={"help": "last.fm", "perms": Permissions.EMBED_LINKS},
         context={
             "method": "album.search",
-            "data_map": ("results", "albummatches", "album"),
             "artwork_type": "Album",
             "meta_type": "album",
-            "names": (("artist", ), ("name", )),
+            "names": ("artist", "name"),
             "name_format": "[{}]: {} - {}",
-            "values": (("mbid", ), ),
+            "values": ("mbid", ),
             "value_format": "MBID: {}",
             "item": "Album",
         })
@@ -399,12 +615,11 @@ class fmPlugin(Plugin):
         metadata={"help": "last.fm", "perms": Permissions.EMBED_LINKS},
         context={
             "method": "track.search",
-            "data_map": ("results", "trackmatches", "track"),
             "artwork_type": "Track",
             "meta_type": "track",
-            "names": (("artist", ), ("name", )),
+            "names": ("artist", "name"),
             "name_format": "[{}]: {} - {}",
-            "values": (("listeners", ), ("mbid", )),
+            "values": ("listeners", "mbid"),
             "value_format": "Listeners: {}, MBID: {}",
             "item": "Track",
         })
@@ -413,7 +628,6 @@ class fmPlugin(Plugin):
             event,
             search,
             method,
-            data_map,
             artwork_type,
             meta_type,
             react="search_embed",
@@ -421,15 +635,26 @@ class fmPlugin(Plugin):
         """
         Search for a {meta_type} on Last.fm.
         """
-        data = self.get_cached({
-                "method": method,
-                meta_type: search.lower(),
-            },
-            cool_down=3600,
+        params = {
+            "method": method,
+            meta_type: search.lower(),
+        }
+        cutoff = self.start_deadline()
+        data, artwork = self.fan_out(
+            partial(self.get_cached, params, cutoff=cutoff),
+            partial(self.get_artwork, search, artwork_type, cutoff=cutoff),
+            return_exceptions=True,
+            cutoff=cutoff,
         )
-        data = get_dict_item(data, data_map)
+        if isinstance(data, BaseException):
+            raise data
+
+        #  Results are still shown if the artwork lookup failed.
+        if isinstance(artwork, BaseException):
+            artwork = None
+
         if data:
-            thumbnail = {"url": self.get_artwork(search, artwork_type)}
+            thumbnail = {"url": artwork}
             content, embed = getattr(self, react)(
                 data,
                 0,
@@ -467,10 +692,8 @@ class fmPlugin(Plugin):
         context={
             "method": "user.gettopalbums",
             "meta_type": "album",
-            "data_map": ("topalbums", "album"),
             "name_format": ("playcount", "raw:plays"),
             "value_format": ("artist", ),
-            "artist_map": ("artist", "name"),
         })
     @Plugin.command(
         "artists",
@@ -480,7 +703,6 @@ class fmPlugin(Plugin):
         context={
             "method": "user.gettopartists",
             "meta_type": "artist",
-            "data_map": ("topartists", "artist"),
             "name_format": ("playcount", "raw:plays"),
         })
     @Plugin.command(
@@ -491,10 +713,8 @@ class fmPlugin(Plugin):
         context={
             "method": "user.gettoptracks",
             "meta_type": "track",
-            "data_map": ("toptracks", "track"),
             "name_format": ("playcount", "raw:plays"),
             "value_format": ("artist", ),
-            "artist_map": ("artist", "name"),
         })
     def on_top_items_command(
             self,
@@ -514,24 +734,42 @@ class fmPlugin(Plugin):
             username = event.author.id
 
         period = self.get_period(event.author.id)
-        fm_embed, lastname = self.generic_user_data(
-            username,
-            channel=event.channel,
-            description=(f"Top {meta_type}s "
-                         f"{self.beautify_period(period, over=True)}."),
-        )
+        username = self.get_username(username, event.channel)
         params = {
             "method": method,
-            "user": lastname,
+            "user": username,
             "limit": limit,
             "period": period,
         }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            limit=limit,
-            singular=False,
-            **kwargs,
+
+        def render():
+            cutoff = self.start_deadline()
+            user_data, response = self.fan_out(
+                partial(self.get_last_account, username, cutoff=cutoff),
+                partial(self.get_cached, params, cutoff=cutoff),
+                cutoff=cutoff,
+            )
+            fm_embed, _ = self.generic_user_data(
+                username,
+                user_data=user_data,
+                description=(f"Top {meta_type}s "
+                             f"{self.beautify_period(period, over=True)}."),
+            )
+            self.get_fm_secondary(
+                embed=fm_embed,
+                params=params,
+                limit=limit,
+                singular=False,
+                response=response,
+                **kwargs,
+            )
+            return fm_embed
+
+        fm_embed = self.get_embed(
+            f"top {meta_type}s",
+            render,
+            user=username.lower(),
+            period=period,
         )
         api_loop(event.channel.send_message, embed=fm_embed)
 
@@ -563,6 +801,7 @@ class fmPlugin(Plugin):
                 else:
                     user.period = {y: x for x, y in periods.items()}[period]
                     bot.sql.flush()
+                    self.invalidate_embeds(user.last_username)
                 api_loop(
                     event.channel.send_message,
                     ("Default period for 'top' commands updated"
@@ -591,9 +830,10 @@ class fmPlugin(Plugin):
         If no arguments are passed, this will return the user's set username.
         """
         if username is not None:
-            username = self.get_last_account(username)["user"]["name"]
+            username = self.get_last_account(username).name
             user = bot.sql(bot.sql.users.query.get, event.author.id)
             if user:
+                self.invalidate_embeds(user.last_username, username)
                 user.last_username = username
                 bot.sql.flush()
             else:
@@ -631,26 +871,36 @@ class fmPlugin(Plugin):
         """
         if username is None:
             username = event.author.id
-        fm_embed, username = self.generic_user_data(
-            username,
-            channel=event.channel,
-        )
+        username = self.get_username(username, event.channel)
         params = {
             "method": "user.getrecenttracks",
             "user": username,
             "limit": 2
         }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            data_map=("recenttracks", "track"),
-            artist_map=("artist", "#text"),
-            name_format=("raw:Recent activity (", "ago", "raw:)"),
-            value_format=("artist", ),
-            singular=False,
-            cool_down=30,
-            limit=2,
-        )
+
+        def render():
+            cutoff = self.start_deadline()
+            user_data, response = self.fan_out(
+                partial(self.get_last_account, username, cutoff=cutoff),
+                partial(self.get_cached, params, cutoff=cutoff),
+                cutoff=cutoff,
+            )
+            fm_embed, _ = self.generic_user_data(
+                username,
+                user_data=user_data,
+            )
+            self.get_fm_secondary(
+                embed=fm_embed,
+                params=params,
+                name_format=("raw:Recent activity (", "ago", "raw:)"),
+                value_format=("artist", ),
+                singular=False,
+                limit=2,
+                response=response,
+            )
+            return fm_embed
+
+        fm_embed = self.get_embed("user", render, user=username.lower())
         api_loop(event.channel.send_message, embed=fm_embed)
 
     @Plugin.command("recent", "[username:str...]",
@@ -666,27 +916,37 @@ class fmPlugin(Plugin):
         if username is None:
             username = event.author.id
 
-        fm_embed, username = self.generic_user_data(
-            username,
-            channel=event.channel,
-            description="Recent tracks",
-        )
+        username = self.get_username(username, event.channel)
         params = {
             "method": "user.getrecenttracks",
             "user": username,
             "limit": limit,
         }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            data_map=("recenttracks", "track"),
-            artist_map=("artist", "#text"),
-            name_format=("ago", ),
-            value_format=("artist", ),
-            limit=limit,
-            cool_down=120,
-            singular=False,
-        )
+
+        def render():
+            cutoff = self.start_deadline()
+            user_data, response = self.fan_out(
+                partial(self.get_last_account, username, cutoff=cutoff),
+                partial(self.get_cached, params, cutoff=cutoff),
+                cutoff=cutoff,
+            )
+            fm_embed, _ = self.generic_user_data(
+                username,
+                user_data=user_data,
+                description="Recent tracks",
+            )
+            self.get_fm_secondary(
+                embed=fm_embed,
+                params=params,
+                name_format=("ago", ),
+                value_format=("artist", ),
+                limit=limit,
+                singular=False,
+                response=response,
+            )
+            return fm_embed
+
+        fm_embed = self.get_embed("recent", render, user=username.lower())
         api_loop(event.channel.send_message, embed=fm_embed)
 
     @Plugin.command("full", "[username:str...]",
@@ -701,76 +961,95 @@ class fmPlugin(Plugin):
         if username is None:
             username = event.author.id
 
-        fm_embed, username = self.generic_user_data(
-            username,
-            channel=event.channel,
-        )
+        username = self.get_username(username, event.channel)
         message = api_loop(event.channel.send_message, "Searching for user.")
         period = self.get_period(event.author.id)
-        params = {
-            "method": "user.getrecenttracks",
-            "user": username,
-            "limit": 3,
-            "period": period,
-        }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            data_map=("recenttracks", "track"),
-            artist_map=("artist", "#text"),
-            name_format=("raw:Recent tracks", ),
-            value_format=("ago", "artist"),
-            value_clamps=("ago", ),
-            limit=3,
-        )
-        params = {
-            "method": "user.gettoptracks",
-            "user": username,
-            "limit": 3,
-            "period": period,
-        }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            artist_map=("artist", "name"),
-            data_map=("toptracks", "track"),
-            name_format=("raw:Top tracks "
-                         f"{self.beautify_period(period, over=True)}", ),
-            value_format=("playcount", "artist"),
-            value_clamps=("playcount", ),
-        )
-        params = {
-            "method": "user.gettopartists",
-            "user": username,
-            "limit": 3,
-            "period": period,
-        }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            data_map=("topartists", "artist"),
-            name_format=("raw:Top artists "
-                         f"{self.beautify_period(period, over=True)}", ),
-            value_format=("playcount", ),
-            value_clamps=("playcount", ),
-        )
-        params = {
-            "method": "user.gettopalbums",
-            "user": username,
-            "limit": 3,
-            "period": period,
-        }
-        self.get_fm_secondary(
-            embed=fm_embed,
-            params=params,
-            artist_map=("artist", "name"),
-            data_map=("topalbums", "album"),
-            name_format=("raw:Top albums "
-                         f"{self.beautify_period(period, over=True)}", ),
-            value_format=("playcount", "artist"),
-            value_clamps=("playcount", ),
-            seperator="\n",
-        )
+        embed_args = {"user": username.lower(), "period": period}
+        missing = []
+
+        def render():
+            over_period = self.beautify_period(period, over=True)
+            sections = (
+                {
+                    "params": {"method": "user.getrecenttracks"},
+                    "name_format": ("raw:Recent tracks", ),
+                    "value_format": ("ago", "artist"),
+                    "value_clamps": ("ago", ),
+                },
+                {
+                    "params": {"method": "user.gettoptracks"},
+                    "name_format": (f"raw:Top tracks {over_period}", ),
+                    "value_format": ("playcount", "artist"),
+                    "value_clamps": ("playcount", ),
+                },
+                {
+                    "params": {"method": "user.gettopartists"},
+                    "name_format": (f"raw:Top artists {over_period}", ),
+                    "value_format": ("playcount", ),
+                    "value_clamps": ("playcount", ),
+                },
+                {
+                    "params": {"method": "user.gettopalbums"},
+                    "name_format": (f"raw:Top albums {over_period}", ),
+                    "value_format": ("playcount", "artist"),
+                    "value_clamps": ("playcount", ),
+                },
+            )
+            for section in sections:
+                section["params"].update({
+                    "user": username,
+                    "limit": 3,
+                    "period": period,
+                })
+
+            cutoff = self.start_deadline()
+            user_data, *responses = self.fan_out(
+                partial(self.get_last_account, username, cutoff=cutoff),
+                *(partial(
+                    self.get_cached,
+                    section["params"],
+                    cutoff=cutoff,
+                ) for section in sections),
+                return_exceptions=True,
+                cutoff=cutoff,
+            )
+            if isinstance(user_data, BaseException):
+                raise user_data
+
+            fm_embed, _ = self.generic_user_data(
+                username,
+                user_data=user_data,
+            )
+            #  Sections which didn't finish in time or whose service is
+            #  down are marked as unavailable rather than holding up the
+            #  rest, while any other error is still raised.
+            for section, response in zip(sections, responses):
+                if isinstance(response, (
+                        fmUnavailable, deadlineExceeded, circuitOpen)):
+                    missing.append(section)
+                    fm_embed.add_field(
+                        name=(self.fm_format_mapping.raw(
+                            section["name_format"][0]) + ":"),
+                        value="Currently unavailable.",
+                        inline=False,
+                    )
+                    continue
+
+                if isinstance(response, BaseException):
+                    raise response
+
+                self.get_fm_secondary(
+                    embed=fm_embed,
+                    limit=3,
+                    response=response,
+                    **section,
+                )
+            return fm_embed
+
+        fm_embed = self.get_embed("full", render, **embed_args)
+        #  Partial results shouldn't be served from the embed cache.
+        if missing:
+            self.embeds.pop(cache_key(embed_args, "full"))
         try:
             api_loop(
                 message.edit,
@@ -787,127 +1066,388 @@ class fmPlugin(Plugin):
             username,
             title_template="{}",
             channel=None,
+            user_data=None,
             **kwargs):
-        user_data = self.get_user(username, channel)
-        username = user_data["name"]
+        if user_data is None:
+            user_data = self.get_user(username, channel)
+        username = user_data.name
         if username is None:
             raise CommandError("User should set a last.fm account "
                                f"using ``{bot.prefix}username``")
 
         registered = strftime(
             "%Y-%m-%dT%H:%M:%S",
-            gmtime(user_data["registered"]["#text"]),
+            gmtime(int(user_data.registered or 0)),
         )
     #    author = {
-    #        "name": title_template.format(user_data["name"]),
-    #        "url": user_data["url"],
-    #        "icon": user_data["image"][-1]["#text"],
+    #        "name": title_template.format(user_data.name),
+    #        "url": user_data.url,
+    #        "icon": user_data.image,
     #    }
         fm_embed = bot.generic_embed(
-            title=title_template.format(user_data["name"]),
-            url=user_data["url"],
-            thumbnail={"url": user_data["image"][-1]["#text"]},
+            title=title_template.format(user_data.name),
+            url=user_data.url,
+            thumbnail={"url": user_data.image},
             #  author=author,
-            footer={"text": (f"{user_data['playcount']} scrobbles, "
+            footer={"text": (f"{user_data.playcount} scrobbles, "
                              f"registered:")},
             timestamp=registered,
             **kwargs,
         )
-        return fm_embed, user_data["name"]
-
-    class cached_object:
-        __slots__ = (
-            "exists",
-            "expire",
-            "data",
-            "error",
-        )
+        return fm_embed, user_data.name
 
-        def __init__(self, exists, expire, data=None, error=None):
-            self.exists = exists
-            self.expire = expire
-            self.data = data
-            self.error = error
+    def get_embed(self, command, render, **kwargs):
+        """
+        Get a command's rendered embed from the result cache, calling
+        `render` on a miss with concurrent identical invocations
+        waiting on the first render rather than racing it.
+        """
+        key = cache_key(kwargs, command)
+        cached = self.embeds.get(key)
+        if cached is not None and not cached.expired_check():
+            cached.hits += 1
+            self.embeds.record(command, "hits")
+            return cached.data
+
+        self.embeds.record(command, "misses")
+        return self.rendering(key, self.render_embed, key, command, render)
+
+    def render_embed(self, key, command, render):
+        embed = render()
+        self.embeds.set(key, cached_object(
+            exists=True,
+            expire=time() + bot.config.api.embed_cache_ttl,
+            data=embed,
+            group=command,
+        ))
+        return embed
+
+    def invalidate_embeds(self, *usernames):
+        """
+        Drop the rendered embeds cached for a set of Last.fm usernames.
+        """
+        for username in filter(None, usernames):
+            self.embeds.flush(
+                lambda key, entry: key_matches(key, "user", username),
+            )
+
+    @staticmethod
+    def start_deadline():
+        return deadline(bot.config.api.command_deadline)
 
-        def validity_check(self):
-            return self.exists and not self.expired_check()
+    @staticmethod
+    def fan_out(*calls, return_exceptions=False, cutoff=None):
+        """
+        Run a group of independent calls concurrently in a bounded pool.
+        Returns the calls' results in the order they were passed,
+        re-raising the first failed call's exception (in that same order)
+        once all the calls have finished unless `return_exceptions` is set,
+        in which case the exceptions are returned in place of the results.
+        Calls which haven't finished by `cutoff` are left to finish in
+        the background and count as having raised deadlineExceeded.
+        """
+        pool = Pool(max(min(len(calls), bot.config.api.fan_out_limit), 1))
+        greenlets = [pool.spawn(call) for call in calls]
+        joinall(greenlets, timeout=cutoff.remaining if cutoff else None)
+        results = []
+        for greenlet in greenlets:
+            if not greenlet.ready():
+                error = deadlineExceeded("Command timed out.")
+                if not return_exceptions:
+                    raise error
+
+                results.append(error)
+            elif greenlet.successful():
+                results.append(greenlet.value)
+            elif return_exceptions:
+                results.append(greenlet.exception)
+            else:
+                raise greenlet.exception
 
-        def expired_check(self):
-            return time() > self.expire
+        return results
 
     def get_cached(
             self,
             params: dict,
             url: str = None,
-            cool_down: int = 300,
-            item: str = "item"):
+            item: str = "item",
+            priority: int = priorities.INTERACTIVE,
+            cutoff=None):
         url = (url or self.BASE_URL)
-        params = {str(key): str(value) for key, value in params.items()}
-        get = self.s.prepare_request(Request("GET", url, params=params))
-        url = get.url
-        if url not in self.cache or not self.cache[url].expired_check():
-            try:
-                r = self.s.send(get)
-            except requestCError as e:
-                self.log.warning(e)
-                raise CommandError("Last.FM isn't available right now.")
-
-            if r.status_code == 200:
-                if cool_down is not None:
-                    self.cache[url] = self.cached_object(
-                        exists=True,
-                        expire=time() + cool_down,
-                        data=r.json(),
-                    )
-                return r.json()
-
-            if r.status_code == 404:
-                self.cache[url] = self.cached_object(
-                    exists=False,
-                    expire=time() + 1800,
-                    error=f"404 - {item} doesn't exist.",
+        #  The request is only prepared once it's known to be a cache miss.
+        key = cache_key(params, url)
+        method = params.get("method")
+        if (priority == priorities.INTERACTIVE and
+                method in bot.config.api.warm_methods):
+            self.usage.record(key, (url, dict(params)))
+            self.usage_hours.record(gmtime().tm_hour)
+        cached = self.cache.get(key)
+        if cached is None and self.disk_cache:
+            cached = self.disk_cache.get(key)
+            if cached is not None:
+                #  The disk tier holds raw responses.
+                if cached.exists:
+                    cached.data = project(method, cached.data)
+                    cached.size = len(key) + sizeof(cached.data)
+                cached.group = method
+                self.cache.set(key, cached)
+
+        if cached is not None and not cached.expired_check():
+            cached.hits += 1
+            if cached.exists:
+                self.cache.record(method, "hits")
+                return cached.data
+
+            self.cache.record(method, "negative_hits")
+            raise fmEntryNotFound(cached.error)
+
+        #  Cached entries which are expired but still within their stale
+        #  window can be served based on the method's cache modes.
+        stale = (cached if cached is not None and cached.exists and
+                 not cached.stale_check() else None)
+        if (stale and time() <= stale.expire +
+                bot.config.api.cache_revalidate.get(method, 0)):
+            stale.hits += 1
+            self.cache.record(method, "stale_hits")
+            if key not in self.in_flight:
+                spawn(
+                    self.revalidate,
+                    key,
+                    params,
+                    url=url,
+                    item=item,
+                    method=method,
                 )
-                raise fmEntryNotFound(self.cache[url].error)
+            return stale.data
 
-            self.log.warning(f"Last.FM threw error {r.status_code}: {r.text}")
-            if bot.config.exception_webhooks:
-                exception_webhooks(
-                    self.client,
-                    bot.config.exception_webhooks,
-                    content=(f"Last.FM threw error {r.status_code}: "
-                             f"```{redact(r.text)[:1950]}```"),
-                )
+        self.cache.record(method, "misses")
+        try:
+            return self.in_flight(
+                key,
+                self.request_cached,
+                key,
+                params,
+                url=url,
+                item=item,
+                priority=priority,
+                method=method,
+                cutoff=cutoff,
+                urgency=priority,
+            )
+        except fmUnavailable as e:
+            if (stale and time() <= stale.expire +
+                    bot.config.api.cache_stale_if_error.get(method, 0)):
+                self.log.info(f"Serving stale {method} response: {e}")
+                stale.hits += 1
+                self.cache.record(method, "stale_hits")
+                return stale.data
 
-            try:
-                message = ": " + r.json().get("message", "")
-            except JSONDecodeError:
-                message = "."
-            else:
-                message = redact(message)
-            raise fmEntryNotFound(f"{r.status_code} - Last.fm threw "
-                                  f"unexpected HTTP status code{message}")
+            raise e
 
-        if self.cache[url].validity_check():
-            return self.cache[url].data
+    def revalidate(
+            self,
+            key,
+            params,
+            url=None,
+            item="item",
+            method=None):
+        """
+        Refresh a stale cache entry in the background.
+        """
+        try:
+            self.in_flight(
+                key,
+                self.request_cached,
+                key,
+                params,
+                url=url,
+                item=item,
+                priority=priorities.BACKGROUND,
+                method=method,
+                urgency=priorities.BACKGROUND,
+            )
+        except CommandError as e:
+            self.log.debug(f"Failed to revalidate {method} response: {e}")
 
-        raise fmEntryNotFound(self.cache[url].error)
+    def request_cached(
+            self,
+            key,
+            params,
+            url=None,
+            item="item",
+            priority=priorities.INTERACTIVE,
+            method=None,
+            cutoff=None):
+        """
+        Send a Last.fm request and cache its response under `key`.
+        """
+        params = {str(name): str(value) for name, value in params.items()}
+        breaker = bot.breakers("Last.fm")
+        #  Checked before queueing so that an open circuit fails fast.
+        if breaker.rejecting:
+            raise fmUnavailable("Last.FM isn't available right now.")
+
+        #  Queued with the command's deadline, as a token that's only
+        #  handed out once it's passed would be wasted.
+        try:
+            api_key = self.keys.acquire(priority, cutoff)
+        except deadlineExceeded:
+            raise fmUnavailable("Last.FM took too long to respond.")
+
+        if api_key is None:
+            raise fmUnavailable("Last.FM isn't available right now.")
+
+        get = bot.http.prepare(
+            "GET",
+            url or self.BASE_URL,
+            params={**params, "format": "json", "api_key": api_key.key},
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            timeout = bot.timeout("Last.fm", cutoff)
+        except deadlineExceeded:
+            raise fmUnavailable("Last.FM took too long to respond.")
+
+        self.cache.record(method, "requests")
+        try:
+            r = breaker.call(
+                self.send_request,
+                get,
+                timeout=timeout,
+                api_key=api_key,
+                failed=server_error,
+            )
+        except circuitOpen as e:
+            raise fmUnavailable(str(e))
+        except (requestCError, requestTimeout) as e:
+            self.log.warning(e)
+            raise fmUnavailable("Last.FM isn't available right now.")
+
+        if r.status_code == 200:
+            #  Decoded once, with the result being shared by the cache.
+            data = project(method, self.loads(r.content))
+            expire = self.ttls.expire(method, params, data)
+            stale_for = max(
+                bot.config.api.cache_revalidate.get(method, 0),
+                bot.config.api.cache_stale_if_error.get(method, 0),
+            )
+            cached = cached_object(
+                exists=True,
+                expire=expire,
+                stale=expire + stale_for,
+                data=data,
+                size=len(key) + sizeof(data),
+                group=method,
+            )
+            self.cache.set(key, cached)
+            if self.disk_cache:
+                self.disk_cache.set(key, cached, r.content)
+            return data
+
+        if r.status_code == 404:
+            cached = cached_object(
+                exists=False,
+                expire=self.ttls.negative_expire(method),
+                error=f"404 - {item} doesn't exist.",
+                size=len(key),
+                group=method,
+            )
+            self.cache.set(key, cached)
+            if self.disk_cache:
+                self.disk_cache.set(key, cached)
+            raise fmEntryNotFound(cached.error)
+
+        try:
+            response = self.loads(r.content)
+        except ValueError:
+            response = {}
+        if not isinstance(response, dict):
+            response = {}
+
+        #  10: invalid API key, 26: suspended API key, 29: rate limited.
+        code = response.get("error")
+        if code in (10, 26, 29) or r.status_code == 429:
+            self.keys.report(
+                api_key,
+                rate_limited=code == 29 or r.status_code == 429,
+            )
+            raise fmUnavailable("Last.FM isn't available right now.")
+
+        self.log.warning(f"Last.FM threw error {r.status_code}: {r.text}")
+        if bot.config.exception_webhooks:
+            exception_webhooks(
+                self.client,
+                bot.config.exception_webhooks,
+                content=(f"Last.FM threw error {r.status_code}: "
+                         f"```{redact(r.text)[:1950]}```"),
+            )
+
+        message = response.get("message")
+        message = ": " + redact(message) if message else "."
+        error = (fmUnavailable if r.status_code >= 500
+                 else fmEntryNotFound)
+        raise error(f"{r.status_code} - Last.fm threw "
+                    f"unexpected HTTP status code{message}")
+
+    def send_request(self, get, timeout=None, api_key=None):
+        """
+        Send a prepared Last.fm request, hedging it with a duplicate once
+        it's taken longer than the rolling p95 latency if enabled.
+        The first response wins, with the other request being cancelled.
+        """
+        if not bot.config.api.last_hedging:
+            return bot.http.send(get, timeout=timeout)
+
+        self.hedges.deposit()
+        first = spawn(self.timed_send, get, timeout)
+        delay = self.latency.percentile(0.95)
+        if delay is None:
+            return first.get()
+
+        first.join(timeout=max(delay, bot.config.api.last_hedge_min_delay))
+        #  Hedges never queue on the rate limiter, so they can't hold up
+        #  other requests, and are counted under their own priority.
+        if first.ready() or not self.hedges.withdraw():
+            return first.get()
+
+        if not self.keys.try_acquire(priorities.HEDGE, api_key):
+            self.hedges.refund()
+            return first.get()
+
+        pending = [first, spawn(self.timed_send, get, timeout)]
+        while True:
+            done = wait(pending, count=1)[0]
+            pending.remove(done)
+            if done.successful() or not pending:
+                for greenlet in pending:
+                    greenlet.kill(block=False)
+                return done.get()
+
+    def timed_send(self, get, timeout=None):
+        start = monotonic()
+        try:
+            return bot.http.send(get, timeout=timeout)
+        finally:
+            #  Killed and failed sends are recorded too, as leaving out
+            #  the slow requests which lost a hedge would skew the p95 low.
+            self.latency.record(monotonic() - start)
 
     class fm_format_mapping:
         @staticmethod
         def playcount(data, **kwargs):
-            count = data.get("playcount")
+            count = data.playcount
             return str(count) if count else "?"
 
         @staticmethod
-        def artist(data, artist_map, **kwargs):
-            artist = get_dict_item(data, artist_map)
+        def artist(data, **kwargs):
+            artist = data.artist
             if artist is None:
                 artist = "Unset"
             return f"{artist} -"
 
         @staticmethod
-        def ago(data, time_map=("date", "uts"), **kwargs):
-            delta = get_dict_item(data, time_map)
+        def ago(data, **kwargs):
+            delta = data.uts
             if delta is not None:
                 delta = str(time_since(delta))
             else:
@@ -926,20 +1466,20 @@ class fmPlugin(Plugin):
             self,
             embed,
             params,
-            data_map,
             url=None,
             name_format=None,
             value_format=None,
             value_clamps=None,
             limit=4,
             inline=False,
-            cool_down=300,
             seperator="\n",
             singular=True,
-            end_value_map=("name", ),
+            response=None,
+            cutoff=None,
             **kwargs):
-        data = self.get_cached(params, url=url, cool_down=cool_down)
-        data = get_dict_item(data, data_map)
+        if response is None:
+            response = self.get_cached(params, url=url, cutoff=cutoff)
+        data = response
         if data and len(data) < limit:
             limit = len(data)
         elif not data:
@@ -983,7 +1523,7 @@ class fmPlugin(Plugin):
                     value += current + " "
                 if not name:
                     name = "Unset"
-                value += get_dict_item(position, end_value_map) + seperator
+                value += (position.name or "") + seperator
                 if not singular:
                     embed.add_field(
                         name=f"{name.strip(' ')}:",
@@ -1003,6 +1543,14 @@ class fmPlugin(Plugin):
             )
 
     def get_user(self, username: str, channel=None):
+        username = self.get_username(username, channel)
+        return self.get_last_account(username)
+
+    def get_username(self, username: str, channel=None):
+        """
+        Resolve a Discord user ID, @user, alias or raw Last.fm username
+        to the Last.fm username that should be looked up.
+        """
         username = str(username)
         result = None
         try:
@@ -1022,15 +1570,22 @@ class fmPlugin(Plugin):
                                     channel.guild.get_member(result.user_id))):
             raise CommandError("User not found in this guild.")
 
-        return self.get_last_account(username)["user"]
+        return username
 
-    def get_last_account(self, username: str):
+    def get_last_account(self, username: str, cutoff=None):
         if self.user_reg.fullmatch(username):
             params = {
                 "method": "user.getinfo",
                 "user": username,
             }
-            user_data = self.get_cached(params, cool_down=1800, item="user")
+            user_data = self.get_cached(
+                params,
+                item="user",
+                cutoff=cutoff,
+            )
+            if user_data is None:
+                raise fmEntryNotFound("404 - user doesn't exist.")
+
             return user_data
 
         raise CommandError("Invalid username format.")
@@ -1104,14 +1659,13 @@ class fmPlugin(Plugin):
 
     @staticmethod
     def search_embed(
-            data: dict,
+            data: tuple,
             index: int,
             names: list,
             name_format: str,
             values: list,
             value_format: str,
             item: str,
-            url_index: list = ("url", ),
             limit: int = 5,
             **kwargs):  # "last"
         fields = list()
@@ -1125,22 +1679,16 @@ class fmPlugin(Plugin):
                 1,
             )
             current_value = value_format[:]
-            for index_list in names:
+            for attribute in names:
                 current_name = current_name.replace(
                     "{}",
-                    get_dict_item(
-                        data[current_index],
-                        index_list
-                    ),
+                    getattr(data[current_index], attribute) or "",
                     1,
                 )
-            for index_list in values:
+            for attribute in values:
                 current_value = current_value.replace(
                     "{}",
-                    get_dict_item(
-                        data[current_index],
-                        index_list,
-                    ),
+                    getattr(data[current_index], attribute) or "",
                     1,
                 )
             fields.append({
@@ -1153,12 +1701,12 @@ class fmPlugin(Plugin):
     #        kwargs["thumbnail"] = self.get_artwork(name, item)
         return None, bot.generic_embed(
             title=f"{item} results.",
-            url=get_dict_item(data[index], url_index),
+            url=data[index].url,
             fields=fields,
             **kwargs,
         )
 
-    def get_artwork(self, name, art_type):
+    def get_artwork(self, name, art_type, cutoff=None):
         type_match = {
             "track": "release",
             "album": "release",
@@ -1172,7 +1720,6 @@ class fmPlugin(Plugin):
         headers = {
             "Authorization": (f"Discogs key={self.discogs_key},"
                               f" secret={self.discogs_secret}"),
-            "User-Agent": bot.config.api.user_agent,
             "Content-Type": "application/json",
         }
         params = {
@@ -1180,8 +1727,18 @@ class fmPlugin(Plugin):
             "type": art_type,
         }
         try:
-            r = get(endpoint, headers=headers, params=params)
-        except requestCError as e:
+            r = bot.breakers("Discogs").call(
+                bot.http.get,
+                endpoint,
+                service="Discogs",
+                deadline=cutoff,
+                headers=headers,
+                params=params,
+                failed=server_error,
+            )
+        except (circuitOpen, deadlineExceeded):
+            return
+        except (requestCError, requestTimeout) as e:
             self.log.warning(e)
         else:
             if r.status_code < 400:
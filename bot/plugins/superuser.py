@@ -10,6 +10,7 @@ from disco.types.permissions import Permissions
 
 
 from bot.base import bot
+from bot.util.cache import describe_key, key_matches
 from bot.util.misc import api_loop, beautify_json, get_base64_image
 from bot.util.sql import Filter_Status, filter_types
 from bot.util.status import status_handler, guildCount
@@ -110,6 +111,7 @@ class superuserPlugin(Plugin):
             else:
                 self.log.info("Caught self")
         bot.sql.flush()
+        bot.sql.drain()
         exit(0)
 
     @Plugin.command("unload", "<plugin_name:str>", level=CommandLevels.OWNER, metadata={"help": "owner"})
@@ -213,7 +215,7 @@ class superuserPlugin(Plugin):
         Used to evaluate raw python3 code.
         The available classes are:
         "bot", "client", "config", "event", "plugins",
-        "prefix_cache", "sql" and "state".
+        "guild_settings", "sql" and "state".
         To get an output, you have to assign the data to a variable
         with "out"/"output" being preferred over other variables.
         """
@@ -223,7 +225,7 @@ class superuserPlugin(Plugin):
             "config": bot.config,
             "event": event,
             "plugins": self.bot.plugins,
-            "prefix_cache": bot.prefix_cache,
+            "guild_settings": bot.guild_settings,
             "sql": bot.sql,
             "state": self.bot.client.state,
         }
@@ -270,7 +272,7 @@ class superuserPlugin(Plugin):
     def add_to_filter(self, event, target, status, target_type="guild"):
         key, target = filter_types.get(self.state, target, target_type)
         data, present = bot.sql.softget(
-            bot.sql.cfilter, **{key: target})
+            bot.sql.filter, **{key: target})
 
         if present:
             if data.status.check(status):
@@ -282,17 +284,21 @@ class superuserPlugin(Plugin):
                 api_loop(event.channel.send_message, "Target added to list.")
 
             data.edit_status(data.status)
-            bot.sql.flush()
+            if data.status.value == 0:
+                bot.sql.delete(data.filter)
+            else:
+                bot.sql.flush()
         else:
             data.status.add(status)
             data.edit_status(data.status)
             bot.sql.add(data.filter)
             api_loop(event.channel.send_message, "Target added :thumbsup:")
 
-        if data.status.value == 0:
-            bot.sql.cfilter.query.filter_by(
-                target=data.filter.target,
-                target_type=data.filter.target_type).delete()
+        bot.filters.set(
+            data.filter.target,
+            data.filter.target_type,
+            data.status.value,
+        )
 
     @Plugin.command(
         "query",
@@ -305,19 +311,145 @@ class superuserPlugin(Plugin):
         """
         if target:
             key, target = filter_types.get(self.state, target, target_type)
-            data = bot.sql.softget(
-                bot.sql.cfilter, **{key: target})[0].status.to_dict()
+            target = bot.sql.filter._search_kwargs(**{key: target})
+            data = Filter_Status(bot.filters.status(
+                target["target"],
+                target["target_type"],
+            )).to_dict()
         else:
             data = {}
-            status = bot.sql.cfilter._wrap(bot.sql.cfilter)
             for item, value in Filter_Status.map._all.items():
-                data[item] = status.get_count(value)
+                data[item] = bot.filters.count(value)
 
-            data["Total"] = bot.sql.cfilter.query.count()
+            data["Total"] = len(bot.filters)
 
         return api_loop(event.channel.send_message,
                         f"Current status:\n```json\n{beautify_json(data)}```")
 
+    @Plugin.command("breakers", level=CommandLevels.OWNER, metadata={"help": "owner"})
+    def on_breakers_command(self, event):
+        """
+        Used to get the state of the upstream services' circuit breakers.
+        """
+        data = bot.breakers.to_dict()
+        if not data:
+            return api_loop(
+                event.channel.send_message,
+                "No upstream services have been called yet.",
+            )
+
+        api_loop(event.channel.send_message,
+                 f"Circuit breakers:\n```json\n{beautify_json(data)}```")
+
+    @Plugin.command("sql", level=CommandLevels.OWNER, metadata={"help": "owner"})
+    def on_sql_command(self, event):
+        """
+        Used to get the database's health, retry and write queue stats.
+        """
+        api_loop(
+            event.channel.send_message,
+            f"Database:\n```json\n{beautify_json(bot.sql.to_dict())}```",
+        )
+
+    @Plugin.command("http", level=CommandLevels.OWNER, metadata={"help": "owner"})
+    def on_http_command(self, event):
+        """
+        Used to get the per-host metrics of the shared HTTP client.
+        """
+        data = bot.http.to_dict()
+        if not data:
+            return api_loop(
+                event.channel.send_message,
+                "No outbound requests have been made yet.",
+            )
+
+        data = beautify_json(data)
+        if len(data) > 1950:
+            return api_loop(
+                event.channel.send_message,
+                attachments=[("http.json", data)],
+            )
+
+        api_loop(event.channel.send_message,
+                 f"Outbound HTTP:\n```json\n{data}```")
+
+    @Plugin.command(
+        "stats",
+        "[method:str]",
+        group="cache", level=CommandLevels.OWNER,
+        metadata={"help": "owner"})
+    def on_cache_stats_command(self, event, method=None):
+        """
+        Used to get the Last.fm cache's statistics.
+        If a Last.fm method is passed, only its statistics will be returned.
+        """
+        fm = self.get_fm_plugin()
+        method = method.lower() if method else None
+        data = {
+            "Entries": len(fm.cache),
+            "Size": fm.cache.size,
+            "Collapsed requests": fm.in_flight.collapsed,
+            "Methods": {str(group): stats.to_dict() for group, stats
+                        in fm.cache.stats.items()
+                        if method is None or group == method},
+            "Largest": {describe_key(key): entry.size for key, entry
+                        in fm.cache.largest(group=method)},
+            "Hottest": {describe_key(key): entry.hits for key, entry
+                        in fm.cache.hottest(group=method)},
+            "Rate limiter": {
+                "Queued": fm.keys.queued,
+                "Priorities": fm.keys.stats,
+                "Keys": fm.keys.to_dict(),
+            },
+            "Hedging": {
+                "Enabled": bot.config.api.last_hedging,
+                "Hedged": fm.hedges.hedged,
+                "Denied": fm.hedges.denied,
+                "p95 latency": fm.latency.percentile(0.95),
+            },
+        }
+        response = f"```json\n{beautify_json(data)}```"
+        attachments = None
+        if len(response) > 2000:
+            attachments = [["cache_stats.json", beautify_json(data)], ]
+            response = "Cache stats:"
+        api_loop(event.channel.send_message, response, attachments=attachments)
+
+    @Plugin.command(
+        "flush",
+        "<target_type:str> [target:str...]",
+        group="cache", level=CommandLevels.OWNER,
+        metadata={"help": "owner"})
+    def on_cache_flush_command(self, event, target_type, target=None):
+        """
+        Used to flush entries from the Last.fm cache.
+        The first argument should be "method", "user" or "all",
+        with the second being the targeted Last.fm method or username.
+        """
+        fm = self.get_fm_plugin()
+        target_type = target_type.lower()
+        if target_type == "all":
+            def check(key, *args):
+                return True
+        elif target_type in ("method", "user") and target:
+            def check(key, *args):
+                return key_matches(key, target_type, target)
+        else:
+            raise CommandError("Invalid target, see ``"
+                               f"{bot.prefix}help cache flush``.")
+
+        count = fm.cache.flush(check)
+        if fm.disk_cache:
+            count += fm.disk_cache.flush(check) or 0
+        api_loop(event.channel.send_message, f"Flushed {count} entries.")
+
+    def get_fm_plugin(self):
+        plugin = self.bot.plugins.get("fmPlugin")
+        if plugin is None:
+            raise CommandError("The fm plugin isn't loaded.")
+
+        return plugin
+
     @Plugin.command("echo", "<payload:str...>", level=CommandLevels.OWNER, metadata={"help": "owner"})
     def on_echo_command(self, event, payload):
         """
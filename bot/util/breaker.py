@@ -0,0 +1,193 @@
+from collections import deque
+from time import monotonic
+import logging
+
+
+from disco.bot.command import CommandError
+
+
+log = logging.getLogger(__name__)
+
+
+class circuitOpen(CommandError):
+    """An upstream service's circuit is open, so calls to it fail fast."""
+
+
+class states:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class circuit_breaker:
+    """
+    Tracks the error rate and latency of calls to an upstream service,
+    opening once too many of the calls in its rolling window fail (or are
+    slower than `slow_call`) and letting a single probe through once
+    `reset_timeout` has passed to decide whether it should close again.
+    """
+    __slots__ = (
+        "name",
+        "error_rate",
+        "min_calls",
+        "window",
+        "slow_call",
+        "reset_timeout",
+        "state",
+        "opened_at",
+        "rejected",
+        "_probing",
+        "_calls",
+    )
+
+    def __init__(
+            self,
+            name,
+            error_rate=0.5,
+            min_calls=10,
+            window=60,
+            slow_call=10.0,
+            reset_timeout=30):
+        self.name = name
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.state = states.CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self._probing = False
+        #  (time, failed, latency) for the calls within the window.
+        self._calls = deque(maxlen=1000)
+
+    @property
+    def rejecting(self):
+        """
+        Whether calls would currently be rejected, without probing.
+        """
+        if self.state == states.OPEN:
+            return monotonic() - self.opened_at < self.reset_timeout
+
+        return self.state == states.HALF_OPEN and self._probing
+
+    def check(self):
+        """
+        Raise circuitOpen if calls shouldn't be made right now,
+        moving to half-open and letting this call through as the
+        probe once the reset timeout has passed.
+        """
+        if self.state == states.OPEN and not self.rejecting:
+            self.state = states.HALF_OPEN
+            self._probing = False
+
+        if self.rejecting:
+            self.rejected += 1
+            raise circuitOpen(f"{self.name} is currently unavailable, "
+                              "try again later.")
+
+        if self.state == states.HALF_OPEN:
+            self._probing = True
+
+    def record(self, failed, latency):
+        now = monotonic()
+        failed = failed or latency >= self.slow_call
+        if self.state == states.HALF_OPEN:
+            self._probing = False
+            if failed:
+                self._open(now)
+            else:
+                log.info(f"Closing {self.name} circuit.")
+                self.state = states.CLOSED
+                self._calls.clear()
+            return
+
+        self._calls.append((now, failed, latency))
+        self._prune(now)
+        if (self.state == states.CLOSED and
+                len(self._calls) >= self.min_calls and
+                self.failure_rate() >= self.error_rate):
+            self._open(now)
+
+    def call(self, function, *args, failed=None, **kwargs):
+        """
+        Call `function` through the breaker, with exceptions and results
+        that `failed` returns True for counting as failures.
+        """
+        self.check()
+        start = monotonic()
+        failure = True
+        try:
+            result = function(*args, **kwargs)
+            failure = bool(failed and failed(result))
+            return result
+        finally:
+            #  Always recorded so that a killed probe can't wedge the
+            #  breaker in half-open.
+            self.record(failure, monotonic() - start)
+
+    def failure_rate(self):
+        if not self._calls:
+            return 0.0
+
+        return sum(call[1] for call in self._calls) / len(self._calls)
+
+    def _open(self, now):
+        if self.state != states.OPEN:
+            log.warning(f"Opening {self.name} circuit.")
+        self.state = states.OPEN
+        self.opened_at = now
+
+    def _prune(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def to_dict(self):
+        self._prune(monotonic())
+        latencies = [call[2] for call in self._calls]
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "failure rate": round(self.failure_rate(), 3),
+            "mean latency": round(sum(latencies) / len(latencies), 3)
+            if latencies else None,
+            "max latency": round(max(latencies), 3) if latencies else None,
+            "rejected": self.rejected,
+            "opened": round(monotonic() - self.opened_at, 1)
+            if self.state != states.CLOSED else None,
+        }
+
+
+class breaker_registry:
+    """
+    The circuit breakers shared between plugins, keyed by service.
+    """
+    __slots__ = (
+        "breakers",
+        "defaults",
+    )
+
+    def __init__(self, **defaults):
+        self.breakers = {}
+        self.defaults = defaults
+
+    def __call__(self, name):
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = circuit_breaker(
+                name,
+                **self.defaults,
+            )
+
+        return breaker
+
+    def to_dict(self):
+        return {name: breaker.to_dict()
+                for name, breaker in self.breakers.items()}
+
+
+def server_error(response):
+    """
+    Whether a response should count as a failure of the upstream service.
+    """
+    return response.status_code >= 500 or response.status_code == 429
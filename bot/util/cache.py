@@ -0,0 +1,627 @@
+from collections import defaultdict, OrderedDict
+from itertools import count
+from time import time
+import heapq
+import logging
+import os
+import pickle
+import sqlite3
+
+
+from gevent.event import AsyncResult
+from gevent.threadpool import ThreadPool
+
+
+from bot.util.decode import loads
+
+
+log = logging.getLogger(__name__)
+
+
+def cache_key(params, url=""):
+    """
+    Get a canonical cache key for a request from its url and parameters
+    without the overhead of preparing the request.
+    """
+    key = url or ""
+    for name, value in sorted(params.items()):
+        key += f"\0{name}\0{value}"
+
+    return key
+
+
+def describe_key(key):
+    """
+    Get a readable representation of a cache key's parameters.
+    """
+    _, *params = key.split("\0")
+    return " ".join(f"{name}={value}" for name, value
+                    in zip(params[::2], params[1::2]))
+
+
+def key_matches(key, name, value):
+    """
+    Check whether a cache key was made with a parameter set to `value`.
+    """
+    return f"\0{name}\0{value}\0".lower() in (key + "\0").lower()
+
+
+class cached_object:
+    __slots__ = (
+        "exists",
+        "expire",
+        "data",
+        "error",
+        "size",
+        "stale",
+        "group",
+        "hits",
+        "packed",
+    )
+
+    def __init__(
+            self,
+            exists,
+            expire,
+            data=None,
+            error=None,
+            size=0,
+            stale=None,
+            group=None,
+            packed=None):
+        self.exists = exists
+        self.expire = expire
+        self.data = data
+        self.error = error
+        self.size = size
+        #  The time until which this entry may still be served once expired.
+        self.stale = expire if stale is None else stale
+        self.group = group
+        self.hits = 0
+        #  The data pickled, for entries restored from a snapshot which are
+        #  only unpickled once they're used.
+        self.packed = packed
+
+    def validity_check(self):
+        return self.exists and not self.expired_check()
+
+    def expired_check(self, now=None):
+        return (now or time()) > self.expire
+
+    def stale_check(self, now=None):
+        return (now or time()) > self.stale
+
+
+class ttl_policy:
+    """
+    Resolves how long Last.fm responses are cached for by method,
+    with a TTL of None meaning that the response never expires.
+    """
+    __slots__ = (
+        "ttls",
+        "default",
+        "negative",
+        "recent_min",
+        "recent_max",
+        "recent_factor",
+        "live_limit",
+        "immutable_params",
+    )
+
+    def __init__(
+            self,
+            ttls=None,
+            default=300,
+            negative=1800,
+            recent_min=30,
+            recent_max=300,
+            recent_factor=0.1,
+            live_limit=2,
+            immutable_params=("mbid", )):
+        self.ttls = ttls or {}
+        self.default = default
+        self.negative = negative
+        self.recent_min = recent_min
+        self.recent_max = recent_max
+        self.recent_factor = recent_factor
+        self.live_limit = live_limit
+        self.immutable_params = tuple(immutable_params or ())
+
+    def expire(self, method, params=None, data=None, now=None):
+        """
+        Get the time a response for `method` should expire at.
+        """
+        now = now or time()
+        if self.immutable(params, now):
+            return float("inf")
+
+        if method == "user.getrecenttracks" and data is not None:
+            ttl = self.recent_ttl(data, now, params)
+        else:
+            ttl = self.ttls.get(method, self.default)
+
+        return float("inf") if ttl is None else now + ttl
+
+    def immutable(self, params, now=None):
+        """
+        Whether a lookup's response won't ever change, which is the case for
+        lookups by an ID like an MBID and for closed ranges (e.g. a weekly
+        chart with a `to` in the past).
+        """
+        if not params:
+            return False
+
+        if any(params.get(param) for param in self.immutable_params):
+            return True
+
+        try:
+            return float(params.get("to", now or time())) < (now or time())
+        except (TypeError, ValueError):
+            return False
+
+    def recent_ttl(self, data, now=None, params=None):
+        """
+        Users who're idle can be cached for far longer than those who are
+        mid-song, so this scales with the time since their last scrobble.
+        """
+        #  Now playing lookups (e.g. fm.np) have to notice a user starting
+        #  to play straight away, however long they were idle for.
+        try:
+            if params and int(params.get("limit", 50)) <= self.live_limit:
+                return self.recent_min
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            uts = data[0].uts
+        except (AttributeError, IndexError, TypeError):
+            return self.recent_min
+
+        #  Tracks which are currently playing don't have a timestamp.
+        if uts is None:
+            return self.recent_min
+
+        idle = max((now or time()) - int(uts), 0)
+        return min(max(idle * self.recent_factor, self.recent_min),
+                   self.recent_max)
+
+    def negative_expire(self, method=None, now=None):
+        return (now or time()) + self.negative
+
+
+class cache_stats:
+    __slots__ = (
+        "hits",
+        "negative_hits",
+        "stale_hits",
+        "misses",
+        "requests",
+        "expirations",
+        "evictions",
+        "entries",
+        "size",
+    )
+
+    def __init__(self):
+        for slot in self.__slots__:
+            setattr(self, slot, 0)
+
+    @property
+    def cold_rate(self):
+        """
+        The fraction of lookups which led to a request being sent.
+        """
+        total = (self.hits + self.negative_hits +
+                 self.stale_hits + self.misses)
+        return self.requests / total if total else 0.0
+
+    def to_dict(self):
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        data["cold_rate"] = round(self.cold_rate, 4)
+        return data
+
+
+class cache_handler:
+    """
+    A bounded LRU cache with an expiration heap.
+
+    Entries are evicted in least recently used order once either
+    `max_entries` or `max_bytes` is exceeded, while expired entries are
+    popped off the top of a min-heap keyed by the time until which they
+    can be served stale rather than found through a full scan of the cache.
+    Statistics are kept per entry group in `stats`.
+    """
+    __slots__ = (
+        "max_entries",
+        "max_bytes",
+        "size",
+        "stats",
+        "_entries",
+        "_expiry",
+        "_counter",
+    )
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats = defaultdict(cache_stats)
+        self._entries = OrderedDict()
+        self._expiry = []
+        self._counter = count()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        self._entries.move_to_end(key)
+        if entry.packed is not None:
+            entry.data = pickle.loads(entry.packed)
+            entry.packed = None
+        return entry
+
+    def set(self, key, entry):
+        self.pop(key)
+        self._entries[key] = entry
+        self.size += entry.size
+        stats = self.stats[entry.group]
+        stats.entries += 1
+        stats.size += entry.size
+        heapq.heappush(
+            self._expiry,
+            (entry.stale, next(self._counter), key),
+        )
+        self.enforce_budget()
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+
+        self.size -= entry.size
+        stats = self.stats[entry.group]
+        stats.entries -= 1
+        stats.size -= entry.size
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+        self._expiry.clear()
+        self.size = 0
+        for stats in self.stats.values():
+            stats.entries = stats.size = 0
+
+    def snapshot(self, now=None):
+        """
+        Get a compact copy of the entries which can still be served,
+        oldest first so that restoring it keeps the LRU order. Each entry's
+        data is pickled separately so that it can be restored lazily.
+        """
+        now = now or time()
+        return [(key, entry.exists, entry.expire, self._pack(entry),
+                 entry.error, entry.size, entry.stale, entry.group)
+                for key, entry in self._entries.items()
+                if not entry.stale_check(now)]
+
+    @staticmethod
+    def _pack(entry):
+        if entry.packed is not None:
+            return entry.packed
+
+        return pickle.dumps(entry.data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, entries, now=None):
+        """
+        Load a snapshot, dropping entries which went stale in the meantime.
+        Each entry's data is only unpickled once it's first got.
+        Returns the amount of entries that were restored.
+        """
+        now = now or time()
+        #  Built straight into the cache with the heap and stats being
+        #  updated once at the end, as going through `set` for each entry
+        #  is far slower when restoring a large snapshot.
+        cache = self._entries
+        expiry = self._expiry
+        counter = self._counter
+        groups = defaultdict(list)
+        for key, exists, expire, packed, error, size, stale, group in entries:
+            if now > stale:
+                continue
+
+            if key in cache:
+                self.pop(key)
+            cache[key] = cached_object(
+                exists, expire, None, error, size, stale, group, packed)
+            expiry.append((stale, next(counter), key))
+            groups[group].append(size)
+
+        restored = 0
+        for group, sizes in groups.items():
+            stats = self.stats[group]
+            stats.entries += len(sizes)
+            stats.size += sum(sizes)
+            self.size += sum(sizes)
+            restored += len(sizes)
+
+        heapq.heapify(expiry)
+        self.enforce_budget()
+        return restored
+
+    def record(self, group, counter, amount=1):
+        stats = self.stats[group]
+        setattr(stats, counter, getattr(stats, counter) + amount)
+
+    def flush(self, check):
+        """
+        Remove the entries which `check(key, entry)` returns True for,
+        returning the amount of entries removed.
+        """
+        keys = [key for key, entry in self._entries.items()
+                if check(key, entry)]
+        for key in keys:
+            self.pop(key)
+
+        return len(keys)
+
+    def largest(self, amount=5, group=None):
+        return heapq.nlargest(
+            amount,
+            self._grouped_items(group),
+            key=lambda item: item[1].size,
+        )
+
+    def hottest(self, amount=5, group=None):
+        return heapq.nlargest(
+            amount,
+            self._grouped_items(group),
+            key=lambda item: item[1].hits,
+        )
+
+    def _grouped_items(self, group=None):
+        return ((key, entry) for key, entry in self._entries.items()
+                if group is None or entry.group == group)
+
+    def enforce_budget(self):
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self.size > self.max_bytes):
+            key = next(iter(self._entries))
+            self.record(self.pop(key).group, "evictions")
+
+        #  Keep stale heap references from outgrowing the live entries.
+        if len(self._expiry) > 2 * len(self._entries) + 64:
+            self._expiry = [item for item in self._expiry
+                            if self._is_current(item)]
+            heapq.heapify(self._expiry)
+
+    def purge_expired(self, now=None):
+        """
+        Remove the entries that have expired,
+        returning the amount of entries removed.
+        """
+        now = now or time()
+        removed = 0
+        while self._expiry and self._expiry[0][0] < now:
+            item = heapq.heappop(self._expiry)
+            #  Skip heap references to entries that've since been replaced.
+            if self._is_current(item):
+                self.record(self.pop(item[2]).group, "expirations")
+                removed += 1
+
+        return removed
+
+    def _is_current(self, item):
+        entry = self._entries.get(item[2])
+        return entry is not None and entry.stale == item[0]
+
+
+class disk_cache:
+    """
+    A persistent SQLite backed cache tier.
+
+    All database access is ran in a single worker thread so reads and writes
+    are serialised without ever blocking the gevent hub.
+    """
+    __slots__ = (
+        "path",
+        "max_bytes",
+        "_connection",
+        "_pool",
+    )
+    #  Bumped whenever the table changes, with out of date tables
+    #  being dropped as their entries can just be fetched again.
+    schema_version = 2
+
+    def __init__(self, path, max_bytes=256 * 1024 ** 2):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._pool = ThreadPool(1)
+        self._pool.apply(self._connect)
+
+    def _connect(self):
+        self._connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        version = self._connection.execute("PRAGMA user_version").fetchone()
+        if version[0] != self.schema_version:
+            log.info("Dropping out of date disk cache "
+                     f"(schema {version[0]}, expected {self.schema_version}).")
+            self._connection.execute("DROP TABLE IF EXISTS cache")
+            self._connection.execute(
+                f"PRAGMA user_version = {self.schema_version}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, "
+            "exists_ INTEGER NOT NULL, "
+            "expire REAL NOT NULL, "
+            "stale REAL NOT NULL, "
+            "data BLOB, "
+            "error TEXT, "
+            "size INTEGER NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def get(self, key):
+        try:
+            return self._pool.apply(self._get, (key, ))
+        except sqlite3.Error as e:
+            log.warning(f"Failed to read from disk cache: {e}")
+
+    def _get(self, key):
+        now = time()
+        row = self._connection.execute(
+            "SELECT exists_, expire, stale, data, error, size "
+            "FROM cache WHERE key = ? AND stale > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return
+
+        self._connection.execute(
+            "UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        exists, expire, stale, data, error, size = row
+        return cached_object(
+            exists=bool(exists),
+            expire=expire,
+            stale=stale,
+            data=loads(data) if data is not None else None,
+            error=error,
+            size=size,
+        )
+
+    def set(self, key, entry, raw=None):
+        """
+        Queue an entry to be written to disk,
+        with `raw` being the entry's undecoded json body.
+        """
+        self._pool.spawn(self._set, key, entry, raw)
+
+    def _set(self, key, entry, raw):
+        try:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, int(entry.exists), entry.expire, entry.stale, raw,
+                 entry.error, len(key) + len(raw or b""), time()),
+            )
+        except sqlite3.Error as e:
+            log.warning(f"Failed to write to disk cache: {e}")
+
+    def compact(self):
+        """
+        Remove expired entries and evict the least recently accessed entries
+        until the cache is within its size limit before vacuuming the file.
+        """
+        try:
+            return self._pool.apply(self._compact)
+        except sqlite3.Error as e:
+            log.warning(f"Failed to compact disk cache: {e}")
+
+    def _compact(self):
+        removed = self._connection.execute(
+            "DELETE FROM cache WHERE stale <= ?", (time(), )).rowcount
+        total = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_bytes:
+            cursor = self._connection.execute(
+                "SELECT key, size FROM cache ORDER BY accessed")
+            to_remove = []
+            for key, size in cursor:
+                if total <= self.max_bytes:
+                    break
+
+                total -= size
+                to_remove.append((key, ))
+            cursor.close()
+            self._connection.executemany(
+                "DELETE FROM cache WHERE key = ?", to_remove)
+            removed += len(to_remove)
+
+        if removed:
+            self._connection.execute("VACUUM")
+
+        return removed
+
+    def flush(self, check):
+        """
+        Remove the entries which `check(key)` returns True for,
+        returning the amount of entries removed.
+        """
+        try:
+            return self._pool.apply(self._flush, (check, ))
+        except sqlite3.Error as e:
+            log.warning(f"Failed to flush disk cache: {e}")
+
+    def _flush(self, check):
+        keys = [(key, ) for key, in self._connection.execute(
+            "SELECT key FROM cache") if check(key)]
+        self._connection.executemany("DELETE FROM cache WHERE key = ?", keys)
+        return len(keys)
+
+    def close(self):
+        try:
+            self._pool.apply(self._connection.close)
+        finally:
+            self._pool.kill()
+
+
+class single_flight:
+    """
+    Used to collapse concurrent calls which share a key into one call,
+    with the callers that arrive while it's in-flight sharing its
+    result or exception.
+    """
+    __slots__ = (
+        "collapsed",
+        "_calls",
+    )
+
+    def __init__(self):
+        self.collapsed = 0
+        self._calls = {}
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    def __call__(self, key, function, *args, urgency=None, **kwargs):
+        """
+        Callers with a more urgent (lower) `urgency` than the in-flight call
+        make their own call rather than waiting on it, so that e.g. a command
+        isn't held up behind a queued bulk request, with later callers
+        joining the more urgent call.
+        """
+        flight = self._calls.get(key)
+        if flight is not None and (urgency is None or flight[0] is None or
+                                   urgency >= flight[0]):
+            self.collapsed += 1
+            return flight[1].get()
+
+        flight = self._calls[key] = (urgency, AsyncResult())
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            flight[1].set_exception(e)
+            raise
+        else:
+            flight[1].set(result)
+            return result
+        finally:
+            if self._calls.get(key) is flight:
+                del self._calls[key]
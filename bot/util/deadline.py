@@ -0,0 +1,34 @@
+from time import monotonic
+
+
+from disco.bot.command import CommandError
+
+
+class deadlineExceeded(CommandError):
+    """A command ran past its deadline."""
+
+
+class deadline:
+    """
+    The point in time a command has to finish by, which is passed down
+    to its sub-requests to clamp their timeouts.
+    """
+    __slots__ = ("expires", )
+
+    def __init__(self, seconds):
+        self.expires = monotonic() + seconds
+
+    @property
+    def remaining(self):
+        return max(self.expires - monotonic(), 0)
+
+    def timeout(self, timeout):
+        """
+        Clamp a (connect, read) timeout to the time that's left,
+        raising deadlineExceeded if there's none left.
+        """
+        remaining = self.remaining
+        if remaining <= 0:
+            raise deadlineExceeded("Command timed out.")
+
+        return tuple(min(part, remaining) for part in timeout)
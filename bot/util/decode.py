@@ -0,0 +1,39 @@
+"""
+Pluggable JSON decoding which prefers the fastest installed decoder.
+"""
+import json
+
+
+decoders = {"json": json.loads}
+try:
+    import ujson
+except ImportError:
+    pass
+else:
+    decoders["ujson"] = ujson.loads
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    decoders["orjson"] = orjson.loads
+
+
+def get_decoder(name=None):
+    """
+    Get a JSON decoder's `loads` function by name,
+    defaulting to the fastest decoder that's available.
+    All of these decoders raise a subclass of ValueError on invalid JSON.
+    """
+    if name is not None:
+        if name not in decoders:
+            raise ValueError(f"JSON decoder `{name}` isn't installed.")
+
+        return decoders[name]
+
+    for name in ("orjson", "ujson", "json"):
+        if name in decoders:
+            return decoders[name]
+
+
+loads = get_decoder()
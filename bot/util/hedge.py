@@ -0,0 +1,87 @@
+"""
+Hedging for requests with a long latency tail, where a duplicate request is
+sent once the original's been slower than most recent requests.
+"""
+from collections import deque
+
+
+class latency_window:
+    """
+    The latencies of the most recent requests, used to get a rolling
+    percentile without re-sorting the window on every request.
+    """
+    __slots__ = (
+        "samples",
+        "min_samples",
+        "_percentiles",
+        "_since_sort",
+    )
+
+    def __init__(self, size=200, min_samples=20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self._percentiles = {}
+        self._since_sort = 0
+
+    def record(self, latency):
+        self.samples.append(latency)
+        self._since_sort += 1
+
+    def percentile(self, percentile=0.95):
+        """
+        Get a percentile of the window, returning None until it's got
+        enough samples for the result to mean anything.
+        """
+        if len(self.samples) < self.min_samples:
+            return
+
+        if self._since_sort >= self.min_samples or not self._percentiles:
+            self._percentiles.clear()
+            self._since_sort = 0
+
+        if percentile not in self._percentiles:
+            ordered = sorted(self.samples)
+            index = min(int(len(ordered) * percentile), len(ordered) - 1)
+            self._percentiles[percentile] = ordered[index]
+
+        return self._percentiles[percentile]
+
+
+class hedge_budget:
+    """
+    Caps hedged requests to a ratio of all requests, with every request
+    earning `ratio` of a hedge up to a burst of `max_credit` hedges.
+    """
+    __slots__ = (
+        "ratio",
+        "max_credit",
+        "credit",
+        "hedged",
+        "denied",
+    )
+
+    def __init__(self, ratio=0.05, max_credit=10):
+        self.ratio = ratio
+        self.max_credit = max_credit
+        self.credit = 0.0
+        self.hedged = 0
+        self.denied = 0
+
+    def deposit(self):
+        self.credit = min(self.credit + self.ratio, self.max_credit)
+
+    def withdraw(self):
+        if self.credit < 1:
+            self.denied += 1
+            return False
+
+        self.credit -= 1
+        self.hedged += 1
+        return True
+
+    def refund(self):
+        """
+        Return a withdrawn hedge which ended up not being sent.
+        """
+        self.credit = min(self.credit + 1, self.max_credit)
+        self.hedged -= 1
@@ -0,0 +1,162 @@
+"""
+The HTTP client shared by every plugin, which keeps connections alive in
+per-host pools rather than opening a new connection for each request.
+"""
+from collections import defaultdict
+from time import monotonic
+from urllib.parse import urlsplit
+
+
+from requests import Request, RequestException, Session
+from requests.adapters import HTTPAdapter
+
+
+class host_metrics:
+    __slots__ = (
+        "calls",
+        "errors",
+        "latency",
+        "max_latency",
+        "statuses",
+    )
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.statuses = defaultdict(int)
+
+    def record(self, latency, status=None):
+        self.calls += 1
+        self.latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if status is None or status >= 500:
+            self.errors += 1
+        if status is not None:
+            self.statuses[status] += 1
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean latency": (round(self.latency / self.calls, 3)
+                             if self.calls else None),
+            "max latency": round(self.max_latency, 3),
+            "statuses": dict(self.statuses),
+        }
+
+
+class http_client:
+    """
+    A pooled requests session with default headers, per-service timeouts
+    and per-host metrics. Under gevent's monkey patching, requests made
+    from different greenlets share the pools without blocking each other.
+    """
+    __slots__ = (
+        "session",
+        "timeouts",
+        "default_timeout",
+        "metrics",
+    )
+
+    def __init__(
+            self,
+            user_agent=None,
+            timeouts=None,
+            default_timeout=(3.05, 10),
+            pool_connections=16,
+            pool_maxsize=32):
+        self.session = Session()
+        self.mount(pool_connections, pool_maxsize)
+        self.timeouts = {}
+        self.default_timeout = default_timeout
+        self.metrics = defaultdict(host_metrics)
+        self.configure(user_agent=user_agent, timeouts=timeouts)
+
+    def configure(
+            self,
+            user_agent=None,
+            timeouts=None,
+            default_timeout=None,
+            pool_maxsize=None):
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+        if timeouts is not None:
+            self.timeouts = {service: tuple(timeout)
+                             for service, timeout in timeouts.items()}
+        if default_timeout is not None:
+            self.default_timeout = tuple(default_timeout)
+        if pool_maxsize is not None:
+            self.mount(pool_maxsize=pool_maxsize)
+
+    def mount(self, pool_connections=16, pool_maxsize=32):
+        """
+        Mount connection pools for `pool_connections` hosts,
+        each keeping up to `pool_maxsize` connections alive.
+        """
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def timeout(self, service=None, deadline=None):
+        """
+        Get a service's (connect, read) timeout,
+        clamped to the time left before `deadline` if passed.
+        """
+        timeout = self.timeouts.get(service, self.default_timeout)
+        return deadline.timeout(timeout) if deadline else timeout
+
+    def prepare(self, method, url, **kwargs):
+        """
+        Prepare a request with the client's default headers.
+        """
+        return self.session.prepare_request(Request(method, url, **kwargs))
+
+    def send(self, request, service=None, timeout=None, deadline=None):
+        """
+        Send a prepared request through the connection pools.
+        """
+        if timeout is None:
+            timeout = self.timeout(service, deadline)
+        metrics = self.metrics[urlsplit(request.url).netloc]
+        start = monotonic()
+        try:
+            r = self.session.send(request, timeout=timeout)
+        except RequestException as e:
+            metrics.record(monotonic() - start)
+            raise e
+
+        metrics.record(monotonic() - start, r.status_code)
+        return r
+
+    def request(
+            self,
+            method,
+            url,
+            service=None,
+            timeout=None,
+            deadline=None,
+            **kwargs):
+        return self.send(
+            self.prepare(method, url, **kwargs),
+            service=service,
+            timeout=timeout,
+            deadline=deadline,
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def to_dict(self):
+        return {host: metrics.to_dict()
+                for host, metrics in self.metrics.items()}
+
+
+client = http_client()
@@ -9,8 +9,12 @@ import re
 
 from disco.api.http import APIException
 from disco.bot.command import CommandError
-from requests import Request, get as real_get
+from requests import Request
 from requests.exceptions import ConnectionError as requestsCError
+from requests.exceptions import Timeout as requestsTimeout
+
+
+from bot.util.http import client
 
 log = logging.getLogger(__name__)
 
@@ -135,15 +139,16 @@ def get(
         params: dict = None,
         endpoint: str = "",
         url: str = None,
-        item: str = "item"):
+        item: str = "item",
+        timeout: tuple = (3.05, 10)):
     url = (url or self.BASE_URL) + endpoint
     if params:
         params = {str(key): str(value) for key, value in params.items()}
     get = self.s.prepare_request(Request("GET", url, params=params))
     service = getattr(self, "SERVICE", None)
     try:
-        r = self.s.send(get)
-    except requestsCError as e:
+        r = self.s.send(get, timeout=timeout)
+    except (requestsCError, requestsTimeout) as e:
         log.warning(e)
         raise CommandError(f"{service} isn't available right now.")
 
@@ -201,7 +206,7 @@ def time_since(time_of_event: int, timezone=pytz.UTC, **kwargs):
     return humanize.naturaltime(time_passed)
 
 
-def get_base64_image(url):
-    r = real_get(url)
+def get_base64_image(url, timeout=None):
+    r = client.get(url, service="Images", timeout=timeout)
     return ("data:" + r.headers["Content-Type"] + ";base64,"
             + base64.b64encode(r.content).decode("utf-8"))
@@ -0,0 +1,276 @@
+from itertools import count
+from time import monotonic
+import heapq
+import logging
+
+
+from gevent import sleep, spawn
+from gevent.event import Event
+
+
+from bot.util.deadline import deadlineExceeded
+
+
+log = logging.getLogger(__name__)
+
+
+class priorities:
+    INTERACTIVE = 0
+    BACKGROUND = 1
+    BULK = 2
+    HEDGE = 3
+    _names = {
+        INTERACTIVE: "interactive",
+        BACKGROUND: "background",
+        BULK: "bulk",
+        HEDGE: "hedge",
+    }
+
+
+class rate_limiter:
+    """
+    A token bucket which queues callers by priority when it's empty,
+    with lower priority values being served first.
+    """
+    __slots__ = (
+        "rate",
+        "burst",
+        "tokens",
+        "updated",
+        "stats",
+        "_waiters",
+        "_counter",
+        "_dispatcher",
+    )
+
+    def __init__(self, rate=5.0, burst=10):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        #  priority: [requests, queued requests, total wait, max wait]
+        self.stats = {priority: [0, 0, 0.0, 0.0]
+                      for priority in priorities._names}
+        self._waiters = []
+        self._counter = count()
+        self._dispatcher = None
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    @property
+    def free(self):
+        """
+        The tokens that'd be left once the queued callers are served.
+        """
+        self._refill()
+        return self.tokens - len(self._waiters)
+
+    def try_acquire(self, priority=priorities.HEDGE):
+        """
+        Take a token only if one's free without queueing.
+        """
+        self._refill()
+        if self._waiters or self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        self._record(priority, 0.0, queued=False)
+        return True
+
+    def contended(self, priority=priorities.BULK):
+        """
+        Check whether callers of a more urgent priority are waiting.
+        """
+        return any(waiter[0] < priority for waiter in self._waiters)
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.updated) * self.rate,
+        )
+        self.updated = now
+
+    def acquire(self, priority=priorities.INTERACTIVE, deadline=None):
+        """
+        Take a token from the bucket, waiting in the queue if none are free.
+        Returns the time spent waiting in seconds, raising deadlineExceeded
+        if `deadline` passes before a token's free.
+        """
+        start = monotonic()
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            self._record(priority, 0.0, queued=False)
+            return 0.0
+
+        waiter = Event()
+        entry = (priority, next(self._counter), waiter)
+        heapq.heappush(self._waiters, entry)
+        if self._dispatcher is None:
+            self._dispatcher = spawn(self._dispatch)
+
+        try:
+            if not waiter.wait(deadline.remaining if deadline else None):
+                raise deadlineExceeded("Command timed out.")
+        except BaseException:
+            #  Killed or timed out, so the token mustn't go to a dead waiter.
+            if waiter.is_set():
+                self.tokens = min(self.burst, self.tokens + 1)
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+        wait = monotonic() - start
+        self._record(priority, wait, queued=True)
+        if wait > 1:
+            log.debug(f"Waited {wait:.2f}s for a "
+                      f"{priorities._names.get(priority)} rate limit token.")
+        return wait
+
+    def _dispatch(self):
+        try:
+            while self._waiters:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    heapq.heappop(self._waiters)[2].set()
+                else:
+                    sleep((1 - self.tokens) / self.rate)
+        finally:
+            self._dispatcher = None
+
+    def _record(self, priority, wait, queued):
+        stats = self.stats.setdefault(priority, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        if queued:
+            stats[1] += 1
+            stats[2] += wait
+            stats[3] = max(stats[3], wait)
+
+
+class api_key:
+    __slots__ = (
+        "key",
+        "limiter",
+        "requests",
+        "errors",
+        "quarantined_until",
+        "reason",
+    )
+
+    def __init__(self, key, limiter):
+        self.key = key
+        self.limiter = limiter
+        self.requests = 0
+        self.errors = 0
+        self.quarantined_until = 0
+        self.reason = None
+
+    def __str__(self):
+        return f"...{self.key[-4:]}"
+
+
+class key_pool:
+    """
+    Spreads requests across a set of API keys, each with their own token
+    bucket, quarantining keys that are reported as rate limited or invalid.
+    """
+    __slots__ = (
+        "keys",
+        "rate_limit_quarantine",
+        "invalid_quarantine",
+    )
+
+    def __init__(
+            self,
+            keys,
+            rate=5.0,
+            burst=10,
+            rate_limit_quarantine=300,
+            invalid_quarantine=86400):
+        self.keys = [api_key(key, rate_limiter(rate=rate, burst=burst))
+                     for key in keys]
+        self.rate_limit_quarantine = rate_limit_quarantine
+        self.invalid_quarantine = invalid_quarantine
+
+    def available(self):
+        now = monotonic()
+        return [key for key in self.keys if key.quarantined_until <= now]
+
+    def acquire(self, priority=priorities.INTERACTIVE, deadline=None):
+        """
+        Take a token from the least loaded key that isn't quarantined,
+        returning the key or None if they're all quarantined.
+        """
+        keys = self.available()
+        if not keys:
+            return
+
+        key = max(keys, key=lambda key: key.limiter.free)
+        key.limiter.acquire(priority, deadline)
+        key.requests += 1
+        return key
+
+    def try_acquire(self, priority=priorities.HEDGE, key=None):
+        """
+        Take a token from `key` (or any key which isn't quarantined)
+        only if one's free without queueing.
+        """
+        for candidate in ((key, ) if key else self.available()):
+            if candidate.limiter.try_acquire(priority):
+                candidate.requests += 1
+                return candidate
+
+    def contended(self, priority=priorities.BULK):
+        return any(key.limiter.contended(priority) for key in self.keys)
+
+    def report(self, key, rate_limited=False):
+        """
+        Quarantine a key that the upstream rejected, with rate limited keys
+        being retried far sooner than invalid or suspended ones.
+        """
+        key.errors += 1
+        if rate_limited:
+            duration = self.rate_limit_quarantine
+            key.reason = "rate limited"
+        else:
+            duration = self.invalid_quarantine
+            key.reason = "invalid or suspended"
+        key.quarantined_until = monotonic() + duration
+        log.warning(f"Quarantined API key {key} for {duration}s, "
+                    f"it's {key.reason}.")
+
+    @property
+    def queued(self):
+        return sum(key.limiter.queued for key in self.keys)
+
+    @property
+    def stats(self):
+        """
+        The keys' limiter stats, summed per priority.
+        """
+        totals = {}
+        for key in self.keys:
+            for priority, stats in key.limiter.stats.items():
+                total = totals.setdefault(priority, [0, 0, 0.0, 0.0])
+                total[0] += stats[0]
+                total[1] += stats[1]
+                total[2] += stats[2]
+                total[3] = max(total[3], stats[3])
+
+        return totals
+
+    def to_dict(self):
+        now = monotonic()
+        return {str(key): {
+            "requests": key.requests,
+            "errors": key.errors,
+            "queued": key.limiter.queued,
+            "quarantined": (round(key.quarantined_until - now)
+                            if key.quarantined_until > now else None),
+            "reason": key.reason,
+        } for key in self.keys}
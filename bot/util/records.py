@@ -0,0 +1,216 @@
+"""
+Compact projections of Last.fm responses which only keep the fields that
+are actually used, as caching the full response trees is wasteful.
+"""
+from sys import getsizeof
+
+
+class record:
+    """
+    Records pickle as their class and slot values, which keeps
+    snapshots of the cache compact and fast to load.
+    """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return (self.__class__,
+                tuple(getattr(self, slot) for slot in self.__slots__))
+
+
+class fm_user(record):
+    __slots__ = (
+        "name",
+        "url",
+        "image",
+        "playcount",
+        "registered",
+    )
+
+    def __init__(
+            self,
+            name,
+            url=None,
+            image=None,
+            playcount=None,
+            registered=None):
+        self.name = name
+        self.url = url
+        self.image = image
+        self.playcount = playcount
+        self.registered = registered
+
+
+class fm_artist(record):
+    __slots__ = (
+        "name",
+        "url",
+        "listeners",
+        "playcount",
+        "ontour",
+    )
+
+    def __init__(
+            self,
+            name,
+            url=None,
+            listeners=None,
+            playcount=None,
+            ontour=None):
+        self.name = name
+        self.url = url
+        self.listeners = listeners
+        self.playcount = playcount
+        self.ontour = ontour
+
+
+class fm_item(record):
+    """
+    A track, artist or album entry from a Last.fm list or search response.
+    """
+    __slots__ = (
+        "name",
+        "artist",
+        "url",
+        "playcount",
+        "listeners",
+        "mbid",
+        "uts",
+    )
+
+    def __init__(
+            self,
+            name,
+            artist=None,
+            url=None,
+            playcount=None,
+            listeners=None,
+            mbid=None,
+            uts=None):
+        self.name = name
+        self.artist = artist
+        self.url = url
+        self.playcount = playcount
+        self.listeners = listeners
+        self.mbid = mbid
+        self.uts = uts
+
+
+def _get(data, path):
+    for index in path:
+        try:
+            data = data[index]
+        except (IndexError, KeyError, TypeError):
+            return
+
+    return data
+
+
+def _last_image(data):
+    images = data.get("image")
+    return images[-1].get("#text") if images else None
+
+
+def project_user(data):
+    user = data.get("user")
+    if user is None:
+        return
+
+    return fm_user(
+        name=user.get("name"),
+        url=user.get("url"),
+        image=_last_image(user),
+        playcount=user.get("playcount"),
+        registered=_get(user, ("registered", "#text")),
+    )
+
+
+def project_artist(data):
+    artist = data.get("artist")
+    if artist is None:
+        return
+
+    return fm_artist(
+        name=artist.get("name"),
+        url=artist.get("url"),
+        listeners=_get(artist, ("stats", "listeners")),
+        playcount=_get(artist, ("stats", "playcount")),
+        ontour=artist.get("ontour"),
+    )
+
+
+def items_projection(data_map, artist_map=None):
+    def project(data):
+        items = _get(data, data_map) or ()
+        #  Last.fm returns a lone object rather than a list for one result.
+        if isinstance(items, dict):
+            items = (items, )
+
+        return tuple(fm_item(
+            name=item.get("name"),
+            artist=_get(item, artist_map) if artist_map else None,
+            url=item.get("url"),
+            playcount=item.get("playcount"),
+            listeners=item.get("listeners"),
+            mbid=item.get("mbid"),
+            uts=_get(item, ("date", "uts")),
+        ) for item in items)
+
+    return project
+
+
+projections = {
+    "user.getinfo": project_user,
+    "artist.getinfo": project_artist,
+    "user.getrecenttracks": items_projection(
+        ("recenttracks", "track"),
+        ("artist", "#text"),
+    ),
+    "user.gettoptracks": items_projection(
+        ("toptracks", "track"),
+        ("artist", "name"),
+    ),
+    "user.gettopartists": items_projection(("topartists", "artist")),
+    "user.gettopalbums": items_projection(
+        ("topalbums", "album"),
+        ("artist", "name"),
+    ),
+    "artist.search": items_projection(("results", "artistmatches", "artist")),
+    "album.search": items_projection(
+        ("results", "albummatches", "album"),
+        ("artist", ),
+    ),
+    "track.search": items_projection(
+        ("results", "trackmatches", "track"),
+        ("artist", ),
+    ),
+}
+
+
+def project(method, data):
+    """
+    Project a decoded Last.fm response to its record(s), with responses
+    from methods that don't have a projection being returned as-is.
+    """
+    projection = projections.get(method)
+    if projection is None or data is None:
+        return data
+
+    return projection(data)
+
+
+def sizeof(data):
+    """
+    Get the approximate memory footprint of a projected response.
+    """
+    if isinstance(data, (tuple, list)):
+        return getsizeof(data) + sum(sizeof(item) for item in data)
+
+    if isinstance(data, dict):
+        return getsizeof(data) + sum(sizeof(key) + sizeof(value)
+                                     for key, value in data.items())
+
+    size = getsizeof(data)
+    for slot in getattr(data, "__slots__", ()):
+        size += getsizeof(getattr(data, slot))
+
+    return size
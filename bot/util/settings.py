@@ -0,0 +1,89 @@
+"""
+Per-guild settings cached in memory, so that reading a guild's settings
+only needs a query the first time the guild's seen.
+"""
+from bot.util.records import record
+
+
+class guild_settings(record):
+    """
+    A guild's settings, with None meaning the default's being used.
+    New settings are added as slots matching a column of the guilds table.
+    """
+    __slots__ = (
+        "prefix",
+        "lyrics_limit",
+    )
+
+    def __init__(self, prefix=None, lyrics_limit=None):
+        self.prefix = prefix
+        self.lyrics_limit = lyrics_limit
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**{slot: getattr(row, slot) for slot in cls.__slots__})
+
+
+class settings_cache:
+    """
+    The settings of each guild, loaded lazily or in batches
+    and written through to SQL by `set`.
+    """
+    __slots__ = (
+        "sql",
+        "settings",
+    )
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.settings = {}
+
+    def __contains__(self, guild_id):
+        return guild_id in self.settings
+
+    def __len__(self):
+        return len(self.settings)
+
+    def get(self, guild_id):
+        settings = self.settings.get(guild_id)
+        if settings is None:
+            guild = self.sql(self.sql.guilds.query.get, guild_id)
+            settings = self.settings[guild_id] = (
+                guild_settings.from_row(guild) if guild else guild_settings()
+            )
+
+        return settings
+
+    def load(self, guild_ids):
+        """
+        Load the settings of several guilds in one query.
+        """
+        guild_ids = list(guild_ids)
+        guilds = self.sql(self.sql.guilds.query.filter(
+            self.sql.guilds.guild_id.in_(guild_ids),
+        ).all)
+        for guild_id in guild_ids:
+            self.settings[guild_id] = guild_settings()
+        for guild in guilds:
+            self.settings[guild.guild_id] = guild_settings.from_row(guild)
+
+    def set(self, guild_id, **values):
+        """
+        Update a guild's settings in SQL and then in the cache.
+        """
+        guild = self.sql(self.sql.guilds.query.get, guild_id)
+        if guild is None:
+            #  Guilds only get a row once they've got a custom setting.
+            if any(value is not None for value in values.values()):
+                guild = self.sql.guilds(guild_id=guild_id, **values)
+                self.sql.add(guild)
+        else:
+            for key, value in values.items():
+                setattr(guild, key, value)
+            self.sql.flush()
+
+        self.settings[guild_id] = (guild_settings.from_row(guild)
+                                   if guild else guild_settings())
+
+    def pop(self, guild_id):
+        return self.settings.pop(guild_id, None)
@@ -0,0 +1,68 @@
+"""
+Local snapshots of in-memory state which let the bot come back warm after
+a plugin reload or a process restart.
+"""
+from contextlib import contextmanager
+from time import time
+import gc
+import logging
+import os
+import pickle
+
+
+log = logging.getLogger(__name__)
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the cyclic garbage collector whilst a large amount of objects are
+    created, as it'd otherwise repeatedly scan them for no gain.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def save_snapshot(path, data):
+    """
+    Atomically write a snapshot along with the time it was taken at.
+    """
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            pickle.dump(
+                (time(), data),
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_path, path)
+    except (OSError, pickle.PicklingError) as e:
+        log.warning(f"Failed to save snapshot `{path}`: {e}")
+    else:
+        log.debug(f"Saved snapshot `{path}`.")
+
+
+def load_snapshot(path, max_age=None):
+    """
+    Load a snapshot, returning None if it's missing, unreadable
+    or older than `max_age` seconds.
+    """
+    try:
+        with open(path, "rb") as file, paused_gc():
+            taken, data = pickle.load(file)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        log.warning(f"Failed to load snapshot `{path}`: {e}")
+        return
+
+    if max_age is not None and time() - taken > max_age:
+        log.info(f"Ignoring outdated snapshot `{path}`.")
+        return
+
+    return data
@@ -1,4 +1,7 @@
-from time import sleep
+from collections import OrderedDict
+from random import uniform
+from time import monotonic
+import atexit
 import copy
 import logging
 import os
@@ -6,8 +9,10 @@ import os
 
 from disco.bot.command import CommandError
 from disco.types.base import BitsetMap, BitsetValue
+from gevent import getcurrent, sleep, spawn_later
+from gevent.lock import RLock
 from sqlalchemy import (
-    create_engine as spawn_engine, PrimaryKeyConstraint,
+    create_engine as spawn_engine, inspect, PrimaryKeyConstraint,
     Column, exc, ForeignKey,
 )
 from sqlalchemy.dialects.mysql import (
@@ -16,10 +21,13 @@ from sqlalchemy.dialects.mysql import (
 from sqlalchemy.engine.url import URL as SQLurl
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import (
-    scoped_session, sessionmaker, relationship,
+    Query, scoped_session, sessionmaker, relationship,
 )
 
 
+from bot.util.breaker import circuit_breaker, circuitOpen
+
+
 log = logging.getLogger(__name__)
 
 
@@ -328,6 +336,315 @@ class wrappedfilter:
             (not target_type or filter.target_type == target_type)).count()
 
 
+class filter_index:
+    """
+    The filter table held in memory as sets of targets keyed by target type,
+    so that checking whether a command's allowed doesn't need any queries.
+    Writes to the table need to be passed through with `set`.
+    """
+    __slots__ = (
+        "sql",
+        "blacklisted",
+        "whitelisted",
+        "loaded",
+    )
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.blacklisted = {}
+        self.whitelisted = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len({
+            (target_type, target)
+            for index in (self.blacklisted, self.whitelisted)
+            for target_type, targets in index.items()
+            for target in targets
+        })
+
+    def load(self):
+        rows = self.sql(self.sql.filter.query.all)
+        self.blacklisted.clear()
+        self.whitelisted.clear()
+        for row in rows:
+            self.set(row.target, row.target_type, row.status)
+        self.loaded = True
+
+    def set(self, target, target_type, status):
+        status = int(status)
+        for flag, index in ((Filter_Status.map.BLACKLISTED, self.blacklisted),
+                            (Filter_Status.map.WHITELISTED, self.whitelisted)):
+            targets = index.setdefault(target_type, set())
+            if status & flag:
+                targets.add(target)
+            else:
+                targets.discard(target)
+
+    def status(self, target, target_type):
+        status = 0
+        if target in self.blacklisted.get(target_type, ()):
+            status |= Filter_Status.map.BLACKLISTED
+        if target in self.whitelisted.get(target_type, ()):
+            status |= Filter_Status.map.WHITELISTED
+        return status
+
+    def count(self, status, target_type=None):
+        index = (self.blacklisted if status == Filter_Status.map.BLACKLISTED
+                 else self.whitelisted)
+        if target_type is not None:
+            return len(index.get(target_type, ()))
+
+        return sum(len(targets) for targets in index.values())
+
+    def allowed(self, channel=None, guild=None, user=None):
+        """
+        Whether a target isn't blacklisted and is either whitelisted
+        or of a type that doesn't have a whitelist.
+        """
+        if not self.loaded:
+            self.load()
+
+        for kwargs in ({"channel": channel, "guild": guild}, {"user": user}):
+            if not any(kwargs.values()):
+                continue
+
+            target = cfilter._search_kwargs(**kwargs)
+            target, target_type = target["target"], target["target_type"]
+            if target in self.blacklisted.get(target_type, ()):
+                return False
+
+            whitelist = self.whitelisted.get(target_type)
+            if whitelist and target not in whitelist:
+                return False
+
+        return True
+
+
+class write_actions:
+    MERGE = 0
+    DELETE = 1
+    REPLACE = 2  # Delete the stored row before merging the new one.
+
+
+class write_queue:
+    """
+    A write-behind queue of ORM mutations, keyed by row so that repeated
+    writes to the same row coalesce into one, which are flushed in a single
+    transaction once `max_size` rows are pending or `max_delay` seconds
+    after the first pending write.
+    Queued objects are detached from the session, so changes made to their
+    relationships afterwards (e.g. appending to `users.friends`) are lost;
+    this is why it's off by default and why code that changes relationships
+    should flush with `immediate` set.
+    """
+    __slots__ = (
+        "sql",
+        "max_size",
+        "max_delay",
+        "pending",
+        "flushing",
+        "lock",
+        "timer",
+        "queued",
+        "coalesced",
+        "batches",
+        "written",
+        "failed",
+    )
+
+    def __init__(self, sql, max_size=100, max_delay=5.0):
+        self.sql = sql
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending = OrderedDict()
+        self.flushing = {}
+        self.lock = RLock()
+        self.timer = None
+        self.queued = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    @staticmethod
+    def key(obj):
+        mapper = inspect(obj).mapper
+        return (
+            obj.__tablename__,
+            tuple(mapper.primary_key_from_instance(obj)),
+        )
+
+    def put(self, obj, action=write_actions.MERGE):
+        key = self.key(obj)
+        previous = self.pending.pop(key, None)
+        if previous is not None:
+            self.coalesced += 1
+            if (action == write_actions.MERGE and
+                    previous[1] != write_actions.MERGE):
+                action = write_actions.REPLACE
+
+        self.pending[key] = (obj, action)
+        self.queued += 1
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = spawn_later(self.max_delay, self.flush)
+
+    @classmethod
+    def cascades(cls, mapper, tables=None):
+        """
+        The tables that deleting a row of `mapper` cascades to.
+        """
+        tables = set() if tables is None else tables
+        for relationship in mapper.relationships:
+            table = relationship.target.name
+            if relationship.cascade.delete and table not in tables:
+                tables.add(table)
+                cls.cascades(relationship.mapper, tables)
+
+        return tables
+
+    def touches(self, tables=None, key=None):
+        """
+        Whether any pending or in-flight writes are for `key` or any of
+        `tables`, including deletes which'll cascade to them.
+        """
+        targets = set(tables or ())
+        if key is not None:
+            targets.add(key[0])
+
+        for batch in (self.pending, self.flushing):
+            if key is not None and key in batch:
+                return True
+
+            if tables and any(table in tables for table, _ in batch):
+                return True
+
+            #  Cascades only happen once the delete's written.
+            if any(action != write_actions.MERGE and
+                   not targets.isdisjoint(self.cascades(inspect(obj).mapper))
+                   for obj, action in batch.values()):
+                return True
+
+        return False
+
+    def flush(self):
+        with self.lock:
+            #  Don't kill the timer if it's the greenlet flushing.
+            if self.timer is not None and self.timer is not getcurrent():
+                self.timer.kill(block=False)
+            self.timer = None
+
+            if not self.pending:
+                return
+
+            self.flushing, self.pending = self.pending, OrderedDict()
+            try:
+                self.write(self.flushing)
+            finally:
+                self.flushing = {}
+
+    def write(self, batch):
+        try:
+            self.sql(self.write_batch, list(batch.values()))
+        except SQLexception as e:
+            #  The database is unavailable, so the batch is kept for later.
+            log.warning(f"Failed to write batch of {len(batch)} rows: {e}")
+            return self.requeue(batch)
+        except Exception as e:
+            #  Retry row by row so that one bad row doesn't lose the batch.
+            log.warning(f"Failed to write batch of {len(batch)} rows, "
+                        f"retrying individually: {e}")
+            for key, entry in batch.items():
+                try:
+                    self.sql(self.write_batch, (entry, ))
+                except SQLexception:
+                    self.requeue({key: entry})
+                except Exception as e:
+                    self.failed += 1
+                    log.exception(f"Dropping write to {entry[0]!r}: {e}")
+        self.batches += 1
+
+    def requeue(self, batch):
+        """
+        Put writes back at the front of the queue,
+        unless the same row's been written to since.
+        """
+        batch = OrderedDict(batch)
+        for key, entry in self.pending.items():
+            batch.pop(key, None)
+            batch[key] = entry
+        self.pending = batch
+        if self.timer is None or self.timer is getcurrent():
+            self.timer = spawn_later(self.max_delay, self.flush)
+
+    def write_batch(self, batch):
+        session = self.sql.session.session_factory()
+        try:
+            with session.begin():
+                for obj, action in batch:
+                    if action != write_actions.MERGE:
+                        stored = session.query(type(obj)).get(
+                            inspect(obj).mapper.primary_key_from_instance(obj))
+                        if stored is not None:
+                            session.delete(stored)
+                        if action == write_actions.DELETE:
+                            continue
+
+                        session.flush()
+                    session.merge(obj)
+        finally:
+            session.close()
+        self.written += len(batch)
+
+    def to_dict(self):
+        return {
+            "pending": len(self.pending),
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+
+class retry_stats:
+    __slots__ = (
+        "retried",
+        "retries",
+        "failed",
+        "rejected",
+        "retry_time",
+    )
+
+    def __init__(self):
+        self.retried = 0
+        self.retries = 0
+        self.failed = 0
+        self.rejected = 0
+        self.retry_time = 0.0
+
+    def record(self, retries, duration, failed=False):
+        self.retried += 1
+        self.retries += retries
+        self.retry_time += duration
+        if failed:
+            self.failed += 1
+
+    def to_dict(self):
+        return {
+            "retried calls": self.retried,
+            "retries": self.retries,
+            "failed calls": self.failed,
+            "rejected calls": self.rejected,
+            "time retrying": round(self.retry_time, 3),
+        }
+
+
 class sql_instance:
     __tables__ = (
         guilds,
@@ -355,7 +672,32 @@ class sql_instance:
             database=None,
             query=None,
             args=None,
-            local_path=None):
+            local_path=None,
+            write_behind=False,
+            write_batch_size=100,
+            write_batch_delay=5.0,
+            retry_attempts=5,
+            retry_base_delay=0.1,
+            retry_max_delay=2.0,
+            unhealthy_error_rate=0.5,
+            unhealthy_min_calls=5,
+            unhealthy_slow_query=5.0,
+            unhealthy_reset=15):
+        self.writes = None
+        self.retry_attempts = retry_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.retries = retry_stats()
+        #  Shared between callers so that they fail fast while the
+        #  database is down rather than all queueing up behind retries.
+        self.health = circuit_breaker(
+            "Database",
+            error_rate=unhealthy_error_rate,
+            min_calls=unhealthy_min_calls,
+            window=60,
+            slow_call=unhealthy_slow_query,
+            reset_timeout=unhealthy_reset,
+        )
         self.session, self.engine = self.create_engine_session_safe(
             drivername,
             host,
@@ -369,23 +711,64 @@ class sql_instance:
         )
         self.check_tables()
         self.spwan_binded_tables()
+        if write_behind:
+            self.writes = write_queue(
+                self,
+                max_size=write_batch_size,
+                max_delay=write_batch_delay,
+            )
+            atexit.register(self.drain)
+
+    def __call__(self, function, *args, **kwargs):
+        if self.writes is not None:
+            self.sync(function, *args)
+
+        try:
+            self.health.check()
+        except circuitOpen as e:
+            self.retries.rejected += 1
+            raise SQLexception(str(e), e)
 
-    @staticmethod
-    def __call__(function, *args, **kwargs):
         tries = 0
-        root_exception = None
+        started = monotonic()
         while True:
-            if tries >= 5:
-                raise SQLexception(
-                    "Failed to access data.",
-                    root_exception,
-                )
+            start = monotonic()
+            failed = True
             try:
-                return function(*args, **kwargs)
+                result = function(*args, **kwargs)
             except exc.OperationalError as e:
-                sleep(2)
-                tries += 1
-                root_exception = e
+                error = e
+            except Exception as e:
+                failed = False
+                raise e
+            else:
+                failed = False
+                if tries:
+                    self.retries.record(tries, monotonic() - started)
+                return result
+            finally:
+                #  Always recorded (with a killed call counting as failed)
+                #  so that a killed probe can't wedge the breaker in
+                #  half-open.
+                self.health.record(failed, monotonic() - start)
+
+            tries += 1
+            #  Stop retrying once the database has been marked as
+            #  unhealthy, as other callers are already failing fast.
+            if tries >= self.retry_attempts or self.health.rejecting:
+                self.retries.record(
+                    tries,
+                    monotonic() - started,
+                    failed=True,
+                )
+                raise SQLexception("Failed to access data.", error)
+
+            #  Full jitter, so that callers which failed together
+            #  don't all retry at the same time.
+            sleep(uniform(0, min(
+                self.retry_max_delay,
+                self.retry_base_delay * 2 ** tries,
+            )))
 
     def spwan_binded_tables(self):
         for table in self.__tables__:
@@ -403,30 +786,104 @@ class sql_instance:
         for table in self.__tables__:
             self.check_engine_table(table, self.engine)
 
-    @staticmethod
-    def softget(obj, *args, **kwargs):
+    def sync(self, function, *args):
+        """
+        Flush the write queue before a query that reads a row with pending
+        writes, so that this process always reads its own writes.
+        """
+        query = getattr(function, "__self__", None)
+        if not isinstance(query, Query):
+            return
+
+        tables = {
+            description["entity"].__tablename__
+            for description in query.column_descriptions
+            if description.get("entity") is not None
+        }
+        if function.__name__ == "get" and len(tables) == 1 and args:
+            ident = args[0] if isinstance(args[0], tuple) else (args[0], )
+            touched = self.writes.touches(key=(tables.pop(), ident))
+        else:
+            touched = self.writes.touches(tables=tables)
+
+        if touched:
+            self.writes.flush()
+
+    def softget(self, obj, *args, **kwargs):
         if hasattr(obj, "_search_kwargs"):
             search_kwargs = obj._search_kwargs(*args, **kwargs)
         else:
             search_kwargs = kwargs
 
-        data = obj.query.filter_by(**search_kwargs).first()
+        query = obj.query.filter_by(**search_kwargs)
+        if self.writes is not None:
+            self.sync(query.first)
+
+        data = query.first()
         if data:
             return obj._wrap(data) if hasattr(obj, "_wrap") else data, True
 
         obj = (getattr(obj, "_get_wrapped", None) or obj)(*args, **kwargs)
         return obj, False
 
-    def add(self, object):
-        self(self.session.add, object)
-        self.flush()
+    def add(self, object, immediate=False):
+        if self.writes is not None and not immediate:
+            #  Queued writes are accepted even while the database is down.
+            self.session.add(object)
+        else:
+            self(self.session.add, object)
+        self.flush(immediate)
 
     def delete(self, object):
+        if self.writes is not None:
+            if object in self.session:
+                self.session.expunge(object)
+            return self.writes.put(object, write_actions.DELETE)
+
         self(self.session.delete, object)
         self.flush()
 
-    def flush(self):
-        self(self.session.flush)
+    def flush(self, immediate=False):
+        """
+        Write the session's changes, or queue them if write-behind's enabled
+        and `immediate` isn't set. An immediate flush writes anything queued
+        first and leaves the objects attached to the session, so their
+        relationships can still be loaded and changed afterwards.
+        """
+        if self.writes is None:
+            return self(self.session.flush)
+
+        if immediate:
+            self.drain()
+            return self(self.session.flush)
+
+        #  Hand the session's changes over to the write queue, detaching
+        #  them so that the session doesn't autoflush them itself.
+        session = self.session()
+        deleted = list(session.deleted)
+        changed = [*session.new, *session.dirty]
+        for obj in (*deleted, *changed):
+            #  Expunging cascades, so some may've already been detached.
+            if obj in session:
+                session.expunge(obj)
+        for obj in deleted:
+            self.writes.put(obj, write_actions.DELETE)
+        for obj in changed:
+            self.writes.put(obj)
+
+    def to_dict(self):
+        return {
+            "health": self.health.to_dict(),
+            "retries": self.retries.to_dict(),
+            "write queue": self.writes.to_dict() if self.writes else None,
+        }
+
+    def drain(self):
+        """
+        Write anything left in the write queue, e.g. before shutting down.
+        """
+        if self.writes is not None:
+            self.writes.flush()
 
     def commit(self):
         self(self.session.commit)
@@ -2,10 +2,10 @@ import logging
 
 
 from disco.types.user import Activity, Status, ActivityTypes
-from requests import post, RequestException
+from requests import RequestException
 
 
-from bot.base import optional
+from bot.base import bot, optional
 
 log = logging.getLogger(__name__)
 
@@ -110,8 +110,9 @@ class status_handler(object):
     @staticmethod
     def post(service, guilds_payload):
         try:
-            r = post(
+            r = bot.http.post(
                 service.url,
+                service="Status",
                 json=service(guilds_payload),
                 headers=service.headers,
             )
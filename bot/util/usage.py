@@ -0,0 +1,60 @@
+from operator import itemgetter
+import heapq
+
+
+class frequency_table:
+    """
+    A bounded table of decaying counts used to track what's requested most.
+    Values can be stored alongside keys to replay them later.
+    """
+    __slots__ = (
+        "max_size",
+        "counts",
+        "values",
+    )
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.counts = {}
+        self.values = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def record(self, key, value=None, amount=1):
+        self.counts[key] = self.counts.get(key, 0) + amount
+        if value is not None:
+            self.values[key] = value
+
+        #  Trimming in bulk keeps recording cheap.
+        if len(self.counts) > self.max_size * 2:
+            self.trim()
+
+    def trim(self):
+        """
+        Drop the coldest keys until the table's back within its size.
+        """
+        excess = len(self.counts) - self.max_size
+        if excess <= 0:
+            return
+
+        for key, _ in heapq.nsmallest(
+                excess, self.counts.items(), key=itemgetter(1)):
+            del self.counts[key]
+            self.values.pop(key, None)
+
+    def decay(self, factor=0.5, minimum=0.5):
+        """
+        Scale every count by `factor`, dropping keys which fall below
+        `minimum` so that the table follows recent usage.
+        """
+        for key, amount in list(self.counts.items()):
+            amount *= factor
+            if amount < minimum:
+                del self.counts[key]
+                self.values.pop(key, None)
+            else:
+                self.counts[key] = amount
+
+    def hottest(self, amount=10):
+        return heapq.nlargest(amount, self.counts.items(), key=itemgetter(1))
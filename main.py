@@ -73,7 +73,13 @@ if __name__ == '__main__':
         log.info("Keyboard interrupt received, unloading plugins.")
         for plugin in disco.plugins.copy().values():
             log.info("Unloading plugin: " + plugin.__class__.__name__)
-            disco.rmv_plugin(plugin.__class__)
+            #  A failing plugin shouldn't stop the rest from being unloaded
+            #  and snapshotting their caches.
+            try:
+                disco.rmv_plugin(plugin.__class__)
+            except Exception as e:
+                log.exception(e)
+                continue
             log.info("Successfully unloaded plugin: "
                      + plugin.__class__.__name__)
         bot.sql.flush()